@@ -0,0 +1,30 @@
+# mesh generation benchmark
+# Times the structured mesh generators for increasing numbers of vertices, up to 10^7.
+# The time per vertex should stay roughly constant (linear scaling).
+
+import time
+
+import numpy as np
+import flexible_fem as fem
+
+n_vertices = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+print("1D")
+print("{0:>10s} {1:>10s} {2:>14s}".format("vertices", "time [s]", "time/vertex [s]"))
+for n in n_vertices:
+    start = time.perf_counter()
+    grid = fem.core.Grid(1, 1, n)
+    elapsed = time.perf_counter() - start
+    print("{0:>10d} {1:>10.3e} {2:>14.3e}".format(len(grid.xy_vert), elapsed, elapsed/len(grid.xy_vert)))
+    del grid
+
+print("2D")
+print("{0:>10s} {1:>10s} {2:>14s}".format("vertices", "time [s]", "time/vertex [s]"))
+for n in n_vertices:
+    nx = int(np.sqrt(n))
+    ny = n//nx
+    start = time.perf_counter()
+    grid = fem.core.Grid(2, 1, nx, 1, ny)
+    elapsed = time.perf_counter() - start
+    print("{0:>10d} {1:>10.3e} {2:>14.3e}".format(len(grid.xy_vert), elapsed, elapsed/len(grid.xy_vert)))
+    del grid
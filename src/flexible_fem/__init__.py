@@ -1,3 +1,15 @@
-__all__ = ["exact", "front"]
-from flexible_fem import exact
-from flexible_fem import front
+import importlib
+
+__all__ = ["core", "exact", "front", "output", "solvers", "transient"]
+
+
+def __getattr__(name):
+    # submodules are imported on first use, so importing the package does not import numpy, scipy
+    # or sympy
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
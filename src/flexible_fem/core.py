@@ -6,8 +6,16 @@ Created on Thu Nov 18 16:50:37 2021
 @author: jfhbuist
 """
 
+import time
+from collections import OrderedDict
+
 import numpy as np
 import scipy as sp
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.spatial
+
+from . import solvers
 
 
 class Grid:
@@ -15,9 +23,21 @@ class Grid:
         self.dim = dim
         if self.dim == 1:
             n = nx
-            self.xy_vert, self.xy_elem, self.xy_bound, self.elmat, self.belmat, self.loc_bound = self.generate_mesh_1D(L, n)
+            self.xy_vert, self.xy_elem, self.xy_bound, self.elmat, self.belmat, self.loc_bound, self.bound_labels = self.generate_mesh_1D(L, n)
+            self.shape = (n,)
+            self.size = (L,)
         elif self.dim == 2:
-            self.xy_vert, self.xy_elem, self.xy_bound, self.elmat, self.belmat, self.loc_bound = self.generate_mesh_2D(L, H, nx, ny)
+            self.xy_vert, self.xy_elem, self.xy_bound, self.elmat, self.belmat, self.loc_bound, self.bound_labels = self.generate_mesh_2D(L, H, nx, ny)
+            self.shape = (nx, ny)
+            self.size = (L, H)
+        # boundary elements and vertices per label
+        self.boundary_elements, self.boundary_vertices = self.generate_boundary_sets()
+        # the generated meshes are structured, which allows fast point location
+        self.structured = True
+        self.point_locator = None
+        self.sparsity_pattern = None
+        # matrices of operators for unit coefficient, per operator type and discretization
+        self.unit_matrices = {}
 
     def generate_mesh_1D(self, L, n):
         xy_vert = np.linspace(0, L, n)
@@ -28,89 +48,311 @@ class Grid:
         # This matrix lists the vertices of each element.
         # ie for element i, evaluate elmat[i], to list the two vertices which
         # border element i
-        elmat = np.zeros((n-1, 2)).astype(int)
-        for idx, element in enumerate(elmat):
-            elmat[idx, 0] = idx
-            elmat[idx, 1] = idx + 1
+        elmat = np.stack([np.arange(n-1), np.arange(1, n)], axis=1)
 
         # This matrix list the vertices of each boundary element.
         # ie for boundary element i, evaluate belmat(i), to list the vertex to which it is connected
-        belmat = np.zeros((len(xy_bound), 1)).astype(int)
-        loc_bound = []  # boundary element locations
-        belmat[0] = 0  # first boundary element is connected to vertex 0
-        loc_bound.append("left")
-        belmat[1] = n-1  # last boundary element is connected to vertex n-1
-        loc_bound.append("right")
-        return xy_vert, xy_elem, xy_bound, elmat, belmat, loc_bound
+        # first boundary element is connected to vertex 0, last boundary element to vertex n-1
+        belmat = np.array([[0], [n-1]])
+        # boundary element locations, given as codes into the table of labels
+        bound_labels = ["left", "right"]
+        loc_bound = np.array([0, 1], dtype=np.int8)
+        return xy_vert, xy_elem, xy_bound, elmat, belmat, loc_bound, bound_labels
 
     def generate_mesh_2D(self, L, H, nx, ny):
         # Create vertices with coordinates
+        # vertex i*ny+j is located at (x[i], y[j])
         x = np.linspace(0, L, nx)
         y = np.linspace(0, H, ny)
-        xm, ym = np.meshgrid(x, y)
-        xy_vert = np.zeros((nx*ny, 2))
-        idx = 0
-        for i in range(nx):
-            for j in range(ny):
-                xy_vert[idx] = np.array([xm[j, i], ym[j, i]])
-                idx += 1
+        xy_vert = np.stack([np.repeat(x, ny), np.tile(y, nx)], axis=1)
 
         # Make triangle elements, based on squares
-        xy_elem = np.zeros((2*(nx-1)*(ny-1), 2))
-        elmat = np.zeros((len(xy_elem), 3)).astype(int)
-        t_idx = 0
-        for i in range(nx-1):
-            for j in range(ny-1):
-                elmat[t_idx, 0] = i*ny+j  # lower left
-                elmat[t_idx, 1] = i*ny+ny+j+1  # upper right
-                elmat[t_idx, 2] = i*ny+j+1  # upper left
-                xy_elem[t_idx] = (xy_vert[elmat[t_idx, 0]] + xy_vert[elmat[t_idx, 1]] + xy_vert[elmat[t_idx, 2]])/3
-                t_idx += 1
-                elmat[t_idx, 0] = i*ny+j  # lower left
-                elmat[t_idx, 1] = i*ny+ny+j  # lower right
-                elmat[t_idx, 2] = i*ny+ny+j+1  # upper right
-                xy_elem[t_idx] = (xy_vert[elmat[t_idx, 0]] + xy_vert[elmat[t_idx, 1]] + xy_vert[elmat[t_idx, 2]])/3
-                t_idx += 1
-        # plt.scatter(xy_elem[:,0],xy_elem[:,1])
+        # each square is identified by the index of its lower left vertex, i*ny+j
+        i = np.arange(nx-1)
+        j = np.arange(ny-1)
+        ll = (i[:, None]*ny + j[None, :]).ravel()  # lower left
+        lr = ll + ny  # lower right
+        ur = ll + ny + 1  # upper right
+        ul = ll + 1  # upper left
+        # two triangles per square, stored consecutively
+        elmat = np.stack([np.stack([ll, ur, ul], axis=1),
+                          np.stack([ll, lr, ur], axis=1)], axis=1).reshape(-1, 3)
+        xy_elem = xy_vert[elmat].sum(axis=1)/3
 
         # Create boundary elements with coordinates for their centers
-        xy_bound = np.zeros((2*(nx-1)+2*(ny-1), 2))
-        belmat = np.zeros((len(xy_bound), 2)).astype(int)
-        loc_bound = []  # boundary element locations
-        b_idx = 0
-        for j in range(ny-1):  # left
-            belmat[b_idx, 0] = 0 + j
-            belmat[b_idx, 1] = 0 + j + 1
-            xy_bound[b_idx] = (xy_vert[belmat[b_idx, 0]] + xy_vert[belmat[b_idx, 1]])/2
-            loc_bound.append("left")
-            b_idx += 1
-        for j in range(ny-1):  # right
-            belmat[b_idx, 0] = (nx-1)*ny + j
-            belmat[b_idx, 1] = (nx-1)*ny + j + 1
-            xy_bound[b_idx] = (xy_vert[belmat[b_idx, 0]] + xy_vert[belmat[b_idx, 1]])/2
-            loc_bound.append("right")
-            b_idx += 1
-        for i in range(nx-1):  # bottom
-            belmat[b_idx, 0] = 0 + i*ny
-            belmat[b_idx, 1] = 0 + i*ny + ny
-            xy_bound[b_idx] = (xy_vert[belmat[b_idx, 0]] + xy_vert[belmat[b_idx, 1]])/2
-            loc_bound.append("bottom")
-            b_idx += 1
-        for i in range(nx-1):  # top
-            belmat[b_idx, 0] = ny-1 + i*ny
-            belmat[b_idx, 1] = ny-1 + i*ny + ny
-            xy_bound[b_idx] = (xy_vert[belmat[b_idx, 0]] + xy_vert[belmat[b_idx, 1]])/2
-            loc_bound.append("top")
-            b_idx += 1
-        # plt.scatter(xy_bound[:,0],xy_bound[:,1])
-
-        return xy_vert, xy_elem, xy_bound, elmat, belmat, loc_bound
+        # boundary element locations are given as codes into the table of labels
+        bound_labels = ["left", "right", "bottom", "top"]
+        belmat = np.concatenate([
+            np.stack([j, j + 1], axis=1),  # left
+            np.stack([(nx-1)*ny + j, (nx-1)*ny + j + 1], axis=1),  # right
+            np.stack([i*ny, i*ny + ny], axis=1),  # bottom
+            np.stack([ny-1 + i*ny, ny-1 + i*ny + ny], axis=1)  # top
+        ])
+        loc_bound = np.repeat(np.arange(4, dtype=np.int8), [ny-1, ny-1, nx-1, nx-1])
+        xy_bound = xy_vert[belmat].sum(axis=1)/2
+
+        return xy_vert, xy_elem, xy_bound, elmat, belmat, loc_bound, bound_labels
+
+    def generate_boundary_sets(self):
+        """Return, per boundary label, the indices of the boundary elements and the unique indices
+        of the vertices connected to them.
+
+        Corner vertices are shared by two labels, and appear in the vertex sets of both.
+        """
+        boundary_elements = {}
+        boundary_vertices = {}
+        for code, lb in enumerate(self.bound_labels):
+            boundary_elements[lb] = np.flatnonzero(self.loc_bound == code)
+            boundary_vertices[lb] = np.unique(self.belmat[boundary_elements[lb]])
+        return boundary_elements, boundary_vertices
+
+    def get_element_coordinates(self):
+        """Return vertex coordinates of all elements, as array of shape (n_elem, k, dim)."""
+        xy_vert = self.xy_vert.reshape(len(self.xy_vert), self.dim)
+        return xy_vert[self.elmat]
+
+    def get_boundary_element_coordinates(self):
+        """Return vertex coordinates of all boundary elements, as array of shape (n_belem, k, dim)."""
+        xy_vert = self.xy_vert.reshape(len(self.xy_vert), self.dim)
+        return xy_vert[self.belmat]
+
+    def get_sparsity_pattern(self):
+        """Return the CSR sparsity pattern of the connectivity of the vertices, and a scatter map.
+
+        The pattern consists of indptr and indices, as in a CSR matrix. The scatter map gives, for
+        each local entry (element i, test function j, basis function k) in the order of a flattened
+        array of element matrices, the position of the corresponding global entry in the data
+        array. The pattern is computed on the first call, and reused afterwards.
+        """
+        if self.sparsity_pattern is None:
+            n = len(self.xy_vert)
+            k = self.elmat.shape[1]
+            rows = np.repeat(self.elmat, k, axis=1).ravel().astype(np.int64)
+            cols = np.tile(self.elmat, (1, k)).ravel().astype(np.int64)
+            # sorting the combined keys orders the entries by row, and by column within each row
+            keys, scatter = np.unique(rows*n + cols, return_inverse=True)
+            # use the index type scipy uses for CSR matrices, so the pattern is shared without copies
+            index_dtype = np.int32 if len(keys) < np.iinfo(np.int32).max else np.int64
+            indices = (keys % n).astype(index_dtype)
+            indptr = np.zeros(n + 1, dtype=index_dtype)
+            indptr[1:] = np.cumsum(np.bincount(keys//n, minlength=n))
+            self.sparsity_pattern = (indptr, indices, scatter.ravel())
+        return self.sparsity_pattern
+
+    def locate_points(self, points):
+        """Find the elements containing a batch of points, and the barycentric coordinates of the
+        points in these elements.
+
+        The point location index is built on the first call, and reused afterwards.
+        """
+        if self.point_locator is None:
+            self.point_locator = PointLocator(self)
+        return self.point_locator.locate(points)
+
+
+class PointLocator:
+    """Index for locating the elements which contain given points.
+
+    For structured grids the element follows from index arithmetic on the uniform grid of squares
+    (or intervals). For general meshes a KD-tree of the element centers is used to find candidate
+    elements, which are then checked.
+    """
+    def __init__(self, grid, tol=10**-10):
+        self.grid = grid
+        self.tol = tol  # tolerance on barycentric coordinates, for points on element edges
+        vert_coords = grid.get_element_coordinates()
+        self.origins = vert_coords[:, 0]
+        # inverse jacobians map (xy - xy0) to xieta, shape (n_elem, dim, dim)
+        edges = vert_coords[:, 1:] - vert_coords[:, :1]
+        self.jac_inv = np.linalg.inv(np.transpose(edges, (0, 2, 1)))
+        if not grid.structured:
+            self.tree = sp.spatial.cKDTree(grid.xy_elem.reshape(len(grid.xy_elem), grid.dim))
+
+    def locate(self, points):
+        """Return element indices, and barycentric coordinates of shape (n_points, k).
+
+        Points outside the mesh get element index -1.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, self.grid.dim)
+        if self.grid.structured:
+            elem, bary = self.locate_structured(points)
+        else:
+            elem, bary = self.locate_tree(points)
+        return elem, bary
+
+    def get_barycentric(self, elem, points):
+        """Barycentric coordinates of points in the given elements, equal to the values of the
+        linear shape functions."""
+        xieta = np.einsum('eij,ej->ei', self.jac_inv[elem], points - self.origins[elem])
+        bary = np.concatenate([1 - xieta.sum(axis=1, keepdims=True), xieta], axis=1)
+        return bary
+
+    def locate_structured(self, points):
+        grid = self.grid
+        spacing = np.array(grid.size)/(np.array(grid.shape) - 1)
+        # index of the square (or interval) containing the point, in each direction
+        idx = np.floor(points/spacing).astype(int)
+        idx = np.clip(idx, 0, np.array(grid.shape) - 2)
+        if grid.dim == 1:
+            elem = idx[:, 0]
+        elif grid.dim == 2:
+            # two triangles per square, the first covers the upper left half
+            local = points/spacing - idx
+            lower = local[:, 0] > local[:, 1]
+            elem = 2*(idx[:, 0]*(grid.shape[1] - 1) + idx[:, 1]) + lower
+        bary = self.get_barycentric(elem, points)
+        outside = np.any(bary < -self.tol, axis=1)
+        elem[outside] = -1
+        return elem, bary
+
+    def locate_tree(self, points):
+        n_elem = len(self.grid.elmat)
+        elem = -np.ones(len(points), dtype=int)
+        bary = np.zeros((len(points), self.grid.elmat.shape[1]))
+        todo = np.arange(len(points))
+        n_candidates = min(8, n_elem)
+        checked = 0
+        while len(todo) > 0 and checked < n_elem:
+            # check the next candidates, in order of distance between point and element center
+            _, candidates = self.tree.query(points[todo], n_candidates)
+            candidates = candidates.reshape(len(todo), n_candidates)
+            for c in range(checked, n_candidates):
+                e = candidates[:, c]
+                b = self.get_barycentric(e, points[todo])
+                inside = np.all(b >= -self.tol, axis=1) & (elem[todo] < 0)
+                elem[todo[inside]] = e[inside]
+                bary[todo[inside]] = b[inside]
+            remaining = elem[todo] < 0
+            todo = todo[remaining]
+            checked = n_candidates
+            n_candidates = min(2*n_candidates, n_elem)
+        return elem, bary
+
+
+class Quadrature:
+    """Fixed quadrature rule on a reference element, stored as arrays of points and weights."""
+    def __init__(self, dim, degree):
+        self.dim = dim
+        self.degree = degree  # polynomials up to this degree are integrated exactly
+        if dim == 0:
+            self.points, self.weights = self.define_rule_point()
+        elif dim == 1:
+            self.points, self.weights = self.define_rule_line(degree)
+        elif dim == 2:
+            self.points, self.weights = self.define_rule_triangle(degree)
+
+    def define_rule_point(self):
+        """Define rule for a zero-width element: evaluate the integrand at the vertex."""
+        points = np.array([[0.0]])
+        weights = np.array([1.0])
+        return points, weights
+
+    def define_rule_line(self, degree):
+        """Define Gauss-Legendre rule on the reference line xi = (0), (1)."""
+        # n Gauss points integrate polynomials up to degree 2n-1 exactly
+        n = degree//2 + 1
+        x, w = np.polynomial.legendre.leggauss(n)
+        # map from [-1, 1] to [0, 1]
+        points = ((x + 1)/2).reshape(n, 1)
+        weights = w/2
+        return points, weights
+
+    def define_rule_triangle(self, degree):
+        """Define symmetric rule on the reference triangle xi, eta = (0,0), (1,0), (0,1)."""
+        # Up to degree 5 the symmetric rules of Dunavant (1985) are used. The points are given in
+        # barycentric coordinates (l0, l1, l2), with xi = l1 and eta = l2. Each orbit lists a
+        # barycentric coordinate a, which is permuted over the vertices as (a, a, 1-2a), and a
+        # weight, normalized such that the weights of a rule sum to one.
+        if degree <= 1:
+            orbits = [(1/3, 1.0)]
+        elif degree == 2:
+            orbits = [(1/6, 1/3)]
+        elif degree <= 4:
+            orbits = [(0.445948490915965, 0.223381589678011),
+                      (0.091576213509771, 0.109951743655322)]
+        elif degree == 5:
+            orbits = [(1/3, 0.225),
+                      (0.470142064105115, 0.132394152788506),
+                      (0.101286507323456, 0.125939180544827)]
+        else:
+            return self.define_rule_triangle_collapsed(degree)
+        points = []
+        weights = []
+        for a, w in orbits:
+            if a == 1/3:
+                # centroid, which is its own orbit
+                points.append([a, a])
+                weights.append(w)
+            else:
+                points.extend([[a, a], [1 - 2*a, a], [a, 1 - 2*a]])
+                weights.extend([w, w, w])
+        # the area of the reference triangle is 1/2
+        points = np.array(points)
+        weights = np.array(weights)/2
+        return points, weights
+
+    def define_rule_triangle_collapsed(self, degree):
+        """Define rule of arbitrary degree on the reference triangle, by collapsing a square."""
+        # Use xi = u, eta = v*(1-u) with u, v in [0, 1], so dxi deta = (1-u) du dv.
+        # The extra factor (1-u) raises the degree in u by one.
+        line = Quadrature(1, degree + 1)
+        u = line.points[:, 0]
+        uu, vv = np.meshgrid(u, u, indexing="ij")
+        wu, wv = np.meshgrid(line.weights, line.weights, indexing="ij")
+        points = np.stack([uu.ravel(), (vv*(1 - uu)).ravel()], axis=1)
+        weights = (wu*wv*(1 - uu)).ravel()
+        return points, weights
+
+
+class Tabulation:
+    """Values of the shape functions at the points of a quadrature rule, on a reference element.
+
+    The values are stored as arrays of shape (nq, k), so integrands over the reference element are
+    array expressions of these values and the weights.
+    """
+    def __init__(self, discretization, dim, degree):
+        rule = discretization.get_quadrature_rule(dim, degree)
+        self.dim = dim
+        self.degree = degree
+        self.points = rule.points
+        self.weights = rule.weights
+        if dim < discretization.dim:
+            # boundary element
+            basis_functions = discretization.basis_functions_bound
+            test_functions = discretization.test_functions_bound
+            self.dphidxieta = discretization.dphidxieta_bound
+            self.dvdxieta = discretization.dvdxieta_bound
+        else:
+            basis_functions = discretization.basis_functions
+            test_functions = discretization.test_functions
+            self.dphidxieta = discretization.dphidxieta
+            self.dvdxieta = discretization.dvdxieta
+        self.phi = discretization.evaluate_shape_functions(basis_functions, self.points)
+        self.v = discretization.evaluate_shape_functions(test_functions, self.points)
 
 
 class Discretization:
-    def __init__(self, dim):
-        """Define discretization by setting basis and test functions."""
+    def __init__(self, dim, quadrature="gauss", degree=None, element_cache=None):
+        """Define discretization by setting basis and test functions.
+
+        Integrals over elements are computed with fixed quadrature rules by default. The degree
+        sets the rule used for integrands which include user functions (source terms and boundary
+        conditions), operators use the lowest degree that is exact for their integrands. By
+        default the degree is 11 in 1D, with 6 Gauss points per element, and 7 in 2D, with a
+        collapsed rule of 25 points per triangle, which resolve sources that oscillate within an
+        element. Setting
+        quadrature to "reference" uses adaptive scipy quadrature instead, for verification.
+        An ElementMatrixCache can be given as element_cache, to compute element matrices once per
+        element shape instead of once per element.
+        """
         self.dim = dim
+        self.quadrature = quadrature
+        if degree is None:
+            degree = 11 if dim == 1 else 7
+        self.degree = degree
+        self.element_cache = element_cache
+        self.quadrature_rules = {}
+        self.tabulations = {}
         # Isoparametric mapping: Use same shape functions for basis functions as for coordinate
         # transformation
         self.basis_functions, self.dphidxieta = self.define_shape_functions()
@@ -201,6 +443,114 @@ class Discretization:
         # jacobian = np.matmul(vert_coords, self.dphidxieta)
         return jacobian
 
+    def get_jacobians(self, vert_coords):
+        """Calculate jacobians dxy/dxieta for a batch of elements.
+
+        The vertex coordinates have shape (n_elem, k, dim), the jacobians shape (n_elem, dim, dim).
+        """
+        # Same as get_jacobian, stacked over all elements
+        jacobians = np.swapaxes(vert_coords, 1, 2) @ self.dphidxieta
+        return jacobians
+
+    def get_determinants(self, jac):
+        """Calculate determinants of a batch of jacobians, of shape (n_elem, dim, dim)."""
+        if self.dim == 1:
+            # the jacobian of a line element is its length
+            return jac[:, 0, 0]
+        return jac[:, 0, 0]*jac[:, 1, 1] - jac[:, 0, 1]*jac[:, 1, 0]
+
+    def get_element_geometry(self, vert_coords):
+        """Calculate determinants and physical gradients of test and basis functions for a batch of
+        elements."""
+        jac = self.get_jacobians(vert_coords)  # dxydxieta
+        if self.dim == 1:
+            # the inverse of the 1x1 jacobian is one over the element length
+            jac_inv = 1/jac  # dxietadxy
+        else:
+            jac_inv = np.linalg.inv(jac)  # dxietadxy
+        det = self.get_determinants(jac)
+        # gradients have shape (n_elem, k, dim)
+        dphidxy = np.einsum('kj,eji->eki', self.dphidxieta, jac_inv)
+        dvdxy = np.einsum('kj,eji->eki', self.dvdxieta, jac_inv)
+        return det, dphidxy, dvdxy
+
+    def get_boundary_determinants(self, vert_coords):
+        """Calculate the determinants of the mapping for a batch of boundary elements, with vertex
+        coordinates of shape (n_belem, k, dim)."""
+        if self.dim == 1:
+            # boundary elements are points, integrals over them are point evaluations
+            det = np.ones(len(vert_coords))
+        elif self.dim == 2:
+            det = np.linalg.norm(vert_coords[:, 1] - vert_coords[:, 0], axis=1)
+        return det
+
+    def evaluate_function(self, function, points):
+        """Evaluate a user function (source term or boundary condition) at points of shape
+        (n_points, dim), returning an array of shape (n_points,).
+
+        The function is called once, with all points as array of shape (n_points, dim). Functions
+        written for a single point xy = [x, y], such as lambda xy: np.sin(xy[0]), do not return one
+        value per point for such an array, and are evaluated point by point with np.vectorize.
+        A single value is only taken as constant if the function gives the same value for single
+        points, since functions such as lambda xy: np.linalg.norm(xy) also return a single value.
+        One value per point in another shape, such as (n_points, 1) from lambda xy: xy[:, [0]], is
+        flattened.
+        """
+        points = np.asarray(points, dtype=float)
+        n_points, dim = points.shape
+        # with at most dim points, xy[0] is a valid array of n_points values, so functions written
+        # for a single point can not be recognized. The points are padded to dim+1 points.
+        padded = np.resize(points, (max(n_points, dim + 1), dim))
+        try:
+            values = np.asarray(function(padded), dtype=float)
+        except (TypeError, ValueError, IndexError):
+            # functions written for a single point may fail on arrays, eg math.sin(xy[0])
+            values = None
+        if values is not None and values.shape == () and not self.is_constant_function(function, padded, values):
+            # the single value is not a constant, the function reduces over the points
+            values = None
+        if values is not None and values.ndim > 1 and values.size == len(padded):
+            values = np.reshape(values, -1)
+        if values is not None and values.shape in [(), (len(padded),)]:
+            values = np.broadcast_to(values, (len(padded),))[:n_points]
+        else:
+            point_function = np.vectorize(lambda *xy: function(list(xy)), otypes=[float])
+            try:
+                values_points = point_function(*points.T)
+            except (TypeError, ValueError, IndexError) as error:
+                if values is None:
+                    raise
+                # the function takes arrays of points, but does not return one value per point
+                raise ValueError(f"Function returned shape {values.shape} for {len(padded)} points, "
+                                 f"expected shape ({len(padded)},).") from error
+            values = values_points
+        return np.array(values, dtype=float)
+
+    def is_constant_function(self, function, points, value):
+        """Check if a function which returned a single value for an array of points gives that value
+        at the first and last of the points as well."""
+        for xy in [points[0], points[-1]]:
+            try:
+                point_value = np.asarray(function(list(xy)), dtype=float)
+            except (TypeError, ValueError, IndexError):
+                return False
+            if point_value.shape != () or point_value != value:
+                return False
+        return True
+
+    def get_point_function(self, function):
+        """Return a user function as function of a single point xy = [x, y], as used by the
+        coordinate transformations."""
+        point_function = lambda xy: self.evaluate_function(function, np.array([xy], dtype=float))[0]
+        return point_function
+
+    def evaluate_shape_functions(self, shape_functions, points):
+        """Evaluate shape functions at the points of a quadrature rule, as array of shape (nq, k)."""
+        values = np.zeros((len(points), len(shape_functions)))
+        for j, shape_function in enumerate(shape_functions):
+            values[:, j] = shape_function(points.T)
+        return values
+
     def coordinate_transformation(self, vert_coords, function_xy):
         """Transform function of xy to function of xieta."""
         dim = self.dim
@@ -308,18 +658,55 @@ class Discretization:
                                     ])
         return function_xy
 
-    def integrate_element(self, integrand, boundary=False):
+    def get_quadrature_rule(self, dim, degree):
+        """Return fixed quadrature rule for element of given dimension, constructed once."""
+        key = (dim, degree)
+        if key not in self.quadrature_rules:
+            self.quadrature_rules[key] = Quadrature(dim, degree)
+        return self.quadrature_rules[key]
+
+    def get_tabulation(self, dim, degree):
+        """Return shape functions tabulated at the points of the quadrature rule for an element of
+        given dimension (point, line or triangle), constructed once."""
+        key = (dim, degree)
+        if key not in self.tabulations:
+            self.tabulations[key] = Tabulation(self, dim, degree)
+        return self.tabulations[key]
+
+    def map_points(self, vert_coords, tabulation):
+        """Map the quadrature points of a tabulation to physical coordinates, for a batch of elements.
+
+        The vertex coordinates have shape (n_elem, k, dim), the result has shape (n_elem, nq, dim).
+        """
+        # Use x = x0*phi0(xieta) + x1*phi1(xieta) + ..., as in coordinate_transformation
+        xy = tabulation.phi @ vert_coords
+        return xy
+
+    def integrate_element(self, integrand, boundary=False, degree=None):
         """Integrate function of xieta over element."""
         if boundary:
             dim = self.dim - 1
         else:
             dim = self.dim
+        if degree is None:
+            degree = self.degree
         if dim == 0:
             result = self.integrate_element_point(integrand)
-        elif dim == 1:
-            result = self.integrate_element_line(integrand)
-        elif dim == 2:
-            result = self.integrate_element_triangle(integrand)
+        elif self.quadrature == "reference":
+            if dim == 1:
+                result = self.integrate_element_line(integrand)
+            elif dim == 2:
+                result = self.integrate_element_triangle(integrand)
+        else:
+            result = self.integrate_element_fixed(integrand, dim, degree)
+        return result
+
+    def integrate_element_fixed(self, integrand, dim, degree):
+        """Integrate function of xieta over element, with fixed quadrature rule."""
+        rule = self.get_quadrature_rule(dim, degree)
+        result = 0
+        for point, weight in zip(rule.points, rule.weights):
+            result += weight*integrand(point)
         return result
 
     def integrate_element_point(self, integrand):
@@ -333,17 +720,19 @@ class Discretization:
         return result
 
     def integrate_element_line(self, integrand):
-        """Integrate 1D function of xi over element."""
+        """Integrate 1D function of xi over element, with adaptive scipy quadrature."""
+        from scipy import integrate  # only needed for reference quadrature
         integrand_expanded = lambda xi: integrand([xi])
-        result = sp.integrate.quad(integrand_expanded, 0, 1)[0]
+        result = integrate.quad(integrand_expanded, 0, 1)[0]
         return result
 
     def integrate_element_triangle(self, integrand):
-        """Integrate 2D function of xieta over element."""
+        """Integrate 2D function of xieta over element, with adaptive scipy quadrature."""
+        from scipy import integrate  # only needed for reference quadrature
         integrand_expanded = lambda eta, xi: integrand([xi, eta])
         eta_lower_bound = 0
         eta_upper_bound = lambda xi: 1 - xi
-        result = sp.integrate.dblquad(integrand_expanded, 0, 1, eta_lower_bound, eta_upper_bound)[0]
+        result = integrate.dblquad(integrand_expanded, 0, 1, eta_lower_bound, eta_upper_bound)[0]
         return result
 
     def check_if_point_in_element(self, vert_coords, point_coords):
@@ -382,6 +771,68 @@ class Discretization:
         return check
 
 
+class ElementMatrixCache:
+    """Element matrices for unit coefficient, cached by element geometry.
+
+    The geometry of an element is given by its edge vectors x_k - x_0, rounded to the tolerance, so
+    elements which are translations of each other share one entry. A structured grid has a single
+    element shape in 1D and two in 2D, and its element matrices become a gather of these entries.
+    At most maxsize entries are kept, the least recently used entry is removed first. Each element
+    counts as a hit if its matrix was taken from the cache, and as a miss if it was computed.
+    """
+    def __init__(self, maxsize=128, tol=10**-10):
+        self.maxsize = maxsize
+        self.tol = tol
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_keys(self, vert_coords):
+        """Return geometry keys of elements with vertex coordinates of shape (n_elem, k, dim)."""
+        edges = vert_coords[:, 1:] - vert_coords[:, :1]
+        keys = np.round(edges/self.tol).astype(np.int64).reshape(len(vert_coords), -1)
+        return keys
+
+    def get_element_matrices(self, operator, vert_coords):
+        """Element matrices of an operator for unit coefficient, as array of shape (n_elem, k, k)."""
+        discretization = operator.discretization
+        keys = self.get_keys(vert_coords)
+        first, inverse, counts = self.group_keys(keys)
+        s_unique = []
+        for key, i, count in zip(keys[first], first, counts):
+            entry = (operator.get_name(), operator.degree, discretization.dim, key.tobytes())
+            if entry in self.entries:
+                self.entries.move_to_end(entry)
+                self.hits += count
+            else:
+                det, dphidxy, dvdxy = discretization.get_element_geometry(vert_coords[i:i+1])
+                self.entries[entry] = operator.integrate_elements(det, dvdxy, dphidxy)[0]
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                self.misses += 1
+                self.hits += count - 1
+            s_unique.append(self.entries[entry])
+        s_elem = np.array(s_unique)[inverse]
+        return s_elem
+
+    def group_keys(self, keys):
+        """Group equal rows of keys, returning the first row of each group, the group of each row,
+        and the size of each group."""
+        # sorting the rows of keys directly is slow, so the rows are grouped by a hash, which is
+        # checked afterwards
+        multipliers = np.array([1000003**j for j in range(keys.shape[1])], dtype=np.uint64)
+        hashes = keys.view(np.uint64) @ multipliers
+        _, first, inverse, counts = np.unique(hashes, return_index=True, return_inverse=True,
+                                              return_counts=True)
+        inverse = inverse.ravel()
+        if not np.array_equal(keys, keys[first][inverse]):
+            # hash collision, group the rows themselves
+            _, first, inverse, counts = np.unique(keys, axis=0, return_index=True, return_inverse=True,
+                                                  return_counts=True)
+            inverse = inverse.ravel()
+        return first, inverse, counts
+
+
 class SourceOperator:
     """Discrete operator determined by a set function."""
     def __init__(self, grid, discretization, operators):
@@ -401,22 +852,37 @@ class SourceOperator:
         For each vertex, sum the contributions of all its neighbouring elements.
         """
         grid = self.grid
-        d = np.zeros(len(grid.xy_vert))
-        for i, xy_i in enumerate(grid.xy_elem):  # loop over elements
-            # xy_i is center of current element
-            elem_vertices = grid.elmat[i]
-            d_elem = self.generate_element_vector(elem_vertices)
-            for j in range(len(elem_vertices)):  # loop over equations for vertex coefficients
-                # Each equation is associated with one test function.
-                # We are now considering the contribution of one element to two different equations (in 1D).
-                # Each equation is associated with two elements (in 1D).
-                # So the equation will be revisted when considering a different element.
-                # From vertex i we have contributions (in 1D):
-                # \int_{x_{i-1}}^{x_{i}} phi1*f + \int_{x_{i}}^{x_{i+1}} phi0*f
-                d[grid.elmat[i, j]] += d_elem[j]
-                # index: equation/test function
+        if self.discretization.quadrature == "reference":
+            d_elem = np.array([self.generate_element_vector(ev) for ev in grid.elmat])
+        else:
+            d_elem = self.generate_element_vectors()
+        # Each equation is associated with one test function, and with multiple elements.
+        # From vertex i we have contributions (in 1D):
+        # \int_{x_{i-1}}^{x_{i}} phi1*f + \int_{x_{i}}^{x_{i+1}} phi0*f
+        # index: equation/test function
+        d = np.bincount(grid.elmat.ravel(), weights=d_elem.ravel(), minlength=len(grid.xy_vert))
         return d
 
+    def generate_element_vectors(self):
+        """Element vectors of all elements, as array of shape (n_elem, k).
+
+        The function is evaluated at the quadrature points of a batch of elements, mapped to
+        physical coordinates, and integrated against the tabulated test functions.
+        """
+        grid = self.grid
+        discretization = self.discretization
+        tabulation = discretization.get_tabulation(discretization.dim, discretization.degree)
+        vert_coords = grid.get_element_coordinates()
+        d_elem = np.zeros(grid.elmat.shape)
+        for start in range(0, len(grid.elmat), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            det = discretization.get_determinants(discretization.get_jacobians(vert_coords[batch]))
+            xy = discretization.map_points(vert_coords[batch], tabulation)
+            f = self.evaluate_function(xy)
+            # multiply by determinant of jacobian to get integral over local element
+            d_elem[batch] = (det[:, None]*tabulation.weights*f) @ tabulation.v
+        return d_elem
+
     def generate_element_vector(self, elem_vertices):
         """Operates on elements."""
         grid = self.grid
@@ -433,10 +899,11 @@ class SourceOperator:
 
 
 class Source(SourceOperator):
-    def __init__(self, grid, discretization, f):
+    def __init__(self, grid, discretization, f, batch_size=10**5):
         self.grid = grid
         self.discretization = discretization
         self.f = f
+        self.batch_size = batch_size
         self.d = self.assemble_source_vector()
 
     def generate_integrand(self, test_function, vert_coords):
@@ -446,58 +913,263 @@ class Source(SourceOperator):
         discretization = self.discretization
         jacobian = discretization.get_jacobian(vert_coords)
         det = np.linalg.det(jacobian)
-        f = self.f
+        f = discretization.get_point_function(self.f)
         # transform f to function of xieta
         f_xieta = discretization.coordinate_transformation(vert_coords, f)
         # multiply by determinant of jacobian to get integral over local element
         integrand = lambda xieta: f_xieta(xieta)*test_function(xieta)*det
         return integrand
 
+    def evaluate_function(self, xy):
+        """Evaluate f at points xy of shape (n_elem, nq, dim), returning shape (n_elem, nq)."""
+        f = self.discretization.evaluate_function(self.f, xy.reshape(-1, xy.shape[-1]))
+        return f.reshape(xy.shape[:-1])
+
 
 class SolutionOperator():
     """Discrete operator acting on the solution."""
     def __init__(self, grid, discretization, operators):
         self.grid = grid
         self.discretization = discretization
+        self.operators = operators
+        self.linear_systems = {}
+        self.element_data = None
         self.s = self.combine_operators(operators)
 
     def combine_operators(self, operators):
-        s = np.zeros(operators[0].s.shape)
+        s = operators[0].s
+        if all(self.shares_pattern(operator.s, s) for operator in operators):
+            # all matrices share the sparsity pattern of the grid, so only the data is added
+            data = np.sum([operator.s.data for operator in operators], axis=0)
+            return sp.sparse.csr_matrix((data, s.indices, s.indptr), shape=s.shape)
+        s = sp.sparse.csr_matrix(operators[0].s.shape)
         for idx, operator in enumerate(operators):
             s = s + operator.s
         return s
 
+    def shares_pattern(self, s0, s1):
+        """Check if two CSR matrices are built on the same sparsity pattern arrays."""
+        return (sp.sparse.isspmatrix_csr(s0) and sp.sparse.isspmatrix_csr(s1) and s0.shape == s1.shape
+                and len(s0.indices) == len(s1.indices) and np.may_share_memory(s0.indices, s1.indices)
+                and np.may_share_memory(s0.indptr, s1.indptr))
+
     def assemble_stiffness_matrix(self):
         """Operates on vertices.
 
         For each vertex, sum the contributions of allits neighbouring elements. Each vertex has an
         accompanying linear basis function. In 1D this is composed of phi1 operating on its left
         element, and phi0 operating on its right element.
+
+        The operator is linear in its coefficient, so for a constant coefficient the matrix is the
+        coefficient times the matrix for unit coefficient, which is assembled only once per grid
+        and discretization. Varying coefficients are included in the element matrices.
+        """
+        if self.discretization.quadrature == "reference" or not self.is_constant(self.coeff):
+            s = self.assemble_matrix(self.generate_element_matrices())
+        else:
+            unit = self.get_unit_matrix()
+            # scale the data only, so the matrix keeps sharing the sparsity pattern
+            s = sp.sparse.csr_matrix((self.coeff*unit.data, unit.indices, unit.indptr), shape=unit.shape)
+        return s
+
+    def get_unit_matrix(self):
+        """Return the matrix of this operator for unit coefficient.
+
+        The matrix is cached on the grid, per operator type and discretization, so it is shared by
+        all operators of the same type on that grid.
+        """
+        grid = self.grid
+        key = (self.get_name(), self.discretization)
+        if key not in grid.unit_matrices:
+            grid.unit_matrices[key] = self.assemble_matrix(self.generate_element_matrices(1))
+        return grid.unit_matrices[key]
+
+    def assemble_matrix(self, s_elem):
+        """Assemble element matrices of shape (n_elem, k, k) into a global matrix.
+
+        For element i, the entry s_elem[i, j, k] is the contribution to the equation of vertex
+        elmat[i, j] (test function) from the coefficient of vertex elmat[i, k] (basis function).
+        Each vertex is shared by multiple elements, so it is visited more than once. The sparsity
+        pattern of the grid gives the slot in the data array of the CSR matrix for each of these
+        contributions, so assembly is a single summation with np.bincount.
+        On structured 1D grids the matrix is tridiagonal, and its diagonals are constructed
+        directly.
         """
         grid = self.grid
-        s = np.zeros((len(grid.xy_vert), len(grid.xy_vert)))  # n = number of vertices
-        for i, xy_i in enumerate(grid.xy_elem):  # loop over elements
-            # xy_i is center of current element
-            elem_vertices = grid.elmat[i]
-            s_elem = self.generate_element_matrix(elem_vertices)
-            for j in range(len(elem_vertices)):  # loop over equations for vertex coefficients
-                # Each equation is associated with one test function.
-                # We are now considering the contribution of one element to two different equations (in 1D).
-                # Each equation is associated with two elements (in 1D).
-                # So the equation will be revisted when considering a different element.
-                for k in range(len(elem_vertices)):  # loop over solution basis functions
-                    # Each basis function is associated with one vertex.
-                    # For each element-equation combination, there are two contributing vertices (in 1D).
-                    # Each vertex is associated with two equations and two elements (in 1D).
-                    # So the vertex will be revisited three times (in 1D).
-                    # From vertex i we have contributions (in 1D):
-                    # \int_{x_{i-1}}^{x_{i}} phi0*phi1*c_i + \int_{x_{i-1}}^{x_{i}} phi1*phi1 c_i + \int_{x_{i}}^{x_{i+1}} phi0*phi0 c_i + \int_{x_{i}}^{x_{i+1}} phi1*phi0 c_i
-                    s[grid.elmat[i, j], grid.elmat[i, k]] += s_elem[j, k]
-                    # first index: equation/test function, second index: vertex coefficient/basis function
+        if grid.dim == 1 and grid.structured:
+            return self.assemble_matrix_tridiagonal(s_elem)
+        n = len(grid.xy_vert)  # n = number of vertices
+        # From vertex i we have contributions (in 1D):
+        # \int_{x_{i-1}}^{x_{i}} phi0*phi1*c_i + \int_{x_{i-1}}^{x_{i}} phi1*phi1 c_i + \int_{x_{i}}^{x_{i+1}} phi0*phi0 c_i + \int_{x_{i}}^{x_{i+1}} phi1*phi0 c_i
+        indptr, indices, scatter = grid.get_sparsity_pattern()
+        data = np.bincount(scatter, weights=s_elem.ravel(), minlength=len(indices))
+        s = sp.sparse.csr_matrix((data, indices, indptr), shape=(n, n))
+        return s
+
+    def assemble_matrix_tridiagonal(self, s_elem):
+        """Assemble element matrices of shape (n_elem, 2, 2) on a structured 1D grid, where element
+        i connects vertices i and i+1."""
+        n = len(self.grid.xy_vert)
+        main = np.zeros(n)
+        main[:-1] += s_elem[:, 0, 0]
+        main[1:] += s_elem[:, 1, 1]
+        upper = s_elem[:, 0, 1]
+        lower = s_elem[:, 1, 0]
+        s = sp.sparse.diags([lower, main, upper], [-1, 0, 1], format="csr")
         return s
 
-    def generate_element_matrix(self, elem_vertices):
-        """Element matrix, operates on elements.
+    def get_coefficients(self):
+        """Return the operator types and coefficients from which this operator is built."""
+        if hasattr(self, "operators"):
+            coefficients = tuple(operator.get_coefficients() for operator in self.operators)
+        elif callable(self.coeff):
+            coefficients = (self.get_name(), self.coeff)
+        elif np.ndim(self.coeff) > 0:
+            # the repr of a large array is abbreviated, so the values themselves are used
+            coefficients = (self.get_name(), np.asarray(self.coeff, dtype=float).tobytes())
+        else:
+            coefficients = (self.get_name(), repr(self.coeff))
+        return coefficients
+
+    def get_name(self):
+        """Return the name of the operator, which identifies its element matrices in caches."""
+        return type(self).__name__
+
+    def is_constant(self, coeff):
+        """Check if a coefficient is constant, ie not an array with a value per element or a
+        function of xy."""
+        return not callable(coeff) and np.ndim(coeff) == 0
+
+    def get_coefficient_function(self, coeff):
+        """Return a coefficient as function of points xy of shape (n_points, dim)."""
+        if callable(coeff):
+            coefficient = coeff
+        elif np.ndim(coeff) == 0:
+            coefficient = lambda xy: coeff
+        else:
+            # value per element, taken from the element containing each point
+            values = np.asarray(coeff, dtype=float)
+            coefficient = lambda xy: values[self.grid.locate_points(xy)[0]]
+        return coefficient
+
+    def evaluate_coefficient(self, coeff, xy):
+        """Evaluate a coefficient at points xy of shape (..., dim), returning shape (...)."""
+        coefficient = self.get_coefficient_function(coeff)
+        values = self.discretization.evaluate_function(coefficient, xy.reshape(-1, xy.shape[-1]))
+        return values.reshape(xy.shape[:-1])
+
+    def get_linear_system(self, dirichlet, solver=None):
+        """Return the linear system of this operator, reduced for the given dirichlet vertices.
+
+        Linear systems are cached, so a factorization is reused as long as the matrix, the
+        coefficients, the set of dirichlet vertices and the solver settings are unchanged.
+        """
+        if solver is None:
+            solver = solvers.LinearSolver()
+        key = (self.get_coefficients(), dirichlet.tobytes(), solver.get_settings())
+        # each entry keeps the matrix it was built from, so a reassembled matrix is not matched
+        if key not in self.linear_systems or self.linear_systems[key][0] is not self.s:
+            self.linear_systems[key] = (self.s, solvers.LinearSystem(self.s, dirichlet, solver))
+        return self.linear_systems[key][1]
+
+    def get_row_sums(self):
+        """Return the sums of the rows of the matrix, without assembling the matrix."""
+        grid = self.grid
+        s_elem = self.generate_element_matrices()
+        row_sums = np.bincount(grid.elmat.ravel(), weights=s_elem.sum(axis=2).ravel(), minlength=len(grid.xy_vert))
+        return row_sums
+
+    def apply(self, u):
+        """Return s @ u without assembling s.
+
+        Each element multiplies the values of u at its vertices with its element matrix, and the
+        products are summed per vertex.
+        """
+        grid = self.grid
+        s_elem = self.get_element_data()
+        y_elem = np.einsum('ejk,ek->ej', s_elem, u[grid.elmat])
+        return np.bincount(grid.elmat.ravel(), weights=y_elem.ravel(), minlength=len(u))
+
+    def get_element_data(self):
+        """Return the data per element used by apply.
+
+        The data is computed on the first call and kept as long as the coefficients of the operator
+        are unchanged.
+        """
+        coefficients = self.get_coefficients()
+        if self.element_data is None or self.element_data[0] != coefficients:
+            self.element_data = (coefficients, self.generate_element_data())
+        return self.element_data[1]
+
+    def generate_element_data(self):
+        return self.generate_element_matrices()
+
+    def get_element_coefficients(self, vert_coords, coeff=None):
+        """Return the coefficient at the quadrature points of all elements, as array of shape
+        (n_elem, n_q) or broadcastable to it, and the tabulation of these points."""
+        if coeff is None:
+            coeff = self.coeff
+        discretization = self.discretization
+        if callable(coeff):
+            tabulation = discretization.get_tabulation(discretization.dim, self.degree + 2)
+            xy = discretization.map_points(vert_coords, tabulation)
+            coeff_q = discretization.evaluate_function(coeff, xy.reshape(-1, xy.shape[-1])).reshape(xy.shape[:-1])
+        else:
+            tabulation = discretization.get_tabulation(discretization.dim, self.degree)
+            coeff_q = np.reshape(np.asarray(coeff, dtype=float), (-1, 1))
+        return coeff_q, tabulation
+
+    def generate_element_matrices(self, coeff=None):
+        """Element matrices of all elements, as array of shape (n_elem, k, k).
+
+        The jacobians, determinants and gradients are computed for all elements at once, and the
+        coefficient is included as described in integrate_elements_coefficient. With reference
+        quadrature, the element matrices are instead integrated one by one.
+        """
+        grid = self.grid
+        discretization = self.discretization
+        if coeff is None:
+            coeff = self.coeff
+        if discretization.quadrature == "reference":
+            if self.is_constant(coeff):
+                s_elem = coeff*np.array([self.generate_element_matrix(ev) for ev in grid.elmat])
+            else:
+                coefficient = self.get_coefficient_function(coeff)
+                s_elem = np.array([self.generate_element_matrix(ev, coefficient) for ev in grid.elmat])
+        elif discretization.element_cache is not None and not callable(coeff):
+            vert_coords = grid.get_element_coordinates()
+            s_elem = self.get_element_factors(coeff)*discretization.element_cache.get_element_matrices(self, vert_coords)
+        else:
+            vert_coords = grid.get_element_coordinates()
+            det, dphidxy, dvdxy = discretization.get_element_geometry(vert_coords)
+            s_elem = self.integrate_elements_coefficient(vert_coords, det, dvdxy, dphidxy, coeff)
+        return s_elem
+
+    def integrate_elements_coefficient(self, vert_coords, det, dvdxy, dphidxy, coeff, elements=slice(None)):
+        """Integrate the operator with coefficient coeff for a batch of elements.
+
+        Constant coefficients and coefficients with a value per element multiply the element
+        matrices for unit coefficient. Coefficients given as function of xy are evaluated at the
+        quadrature points of all elements at once, with a rule that is exact for coefficients which
+        vary quadratically over an element.
+        """
+        if callable(coeff):
+            coeff_q, tabulation = self.get_element_coefficients(vert_coords, coeff)
+            s_elem = self.integrate_elements(det, dvdxy, dphidxy, coeff_q, tabulation)
+        else:
+            s_elem = self.get_element_factors(coeff, elements)*self.integrate_elements(det, dvdxy, dphidxy)
+        return s_elem
+
+    def get_element_factors(self, coeff, elements=slice(None)):
+        """Return a constant coefficient, or the values of a coefficient per element for a batch of
+        elements, shaped to multiply element matrices."""
+        if np.ndim(coeff) == 0:
+            return coeff
+        return np.asarray(coeff, dtype=float)[elements][:, None, None]
+
+    def generate_element_matrix(self, elem_vertices, coefficient=None):
+        """Element matrix for unit coefficient, or for a coefficient given as function of xy,
+        operates on elements.
 
         Matrix should be symmetric. Numerical calculation.
         """
@@ -514,6 +1186,10 @@ class SolutionOperator():
         dvdxieta = discretization.dvdxieta
         dphidxy = np.matmul(dphidxieta, jac_inv)
         dvdxy = np.matmul(dvdxieta, jac_inv)
+        if coefficient is not None:
+            # transform coefficient to function of xieta
+            coefficient_xieta = discretization.coordinate_transformation(
+                vert_coords, discretization.get_point_function(coefficient))
         # calculate s_ij
         s_elem = np.zeros((len(test_functions), len(test_functions)))
         for j, test_function in enumerate(basis_functions):  # loop over test functions
@@ -521,8 +1197,10 @@ class SolutionOperator():
             for k, basis_function in enumerate(basis_functions):  # loop over solution basis functions
                 dphikdxy = dphidxy[k]
                 integrand = self.generate_integrand(test_function, basis_function, dvjdxy, dphikdxy, det, vert_coords)
+                if coefficient is not None:
+                    integrand = lambda xieta, integrand=integrand: coefficient_xieta(xieta)*integrand(xieta)
                 # integrate over element and put in element matrix
-                s_elem[j, k] = discretization.integrate_element(integrand)
+                s_elem[j, k] = discretization.integrate_element(integrand, degree=self.degree)
         return s_elem
 
 
@@ -540,7 +1218,7 @@ class NaturalBoundary():
             b_nat = b_nat + operator.b_nat
         return b_nat
 
-    def generate_natural_boundary_term(self, belem_vertices, lb):
+    def generate_natural_boundary_term(self, belem_vertices, lb, bc_functions=None):
         """Operates on boundary element.
 
         Natural boundary conditions are implicitly satisfied by the formulation.
@@ -548,7 +1226,8 @@ class NaturalBoundary():
         grid = self.grid
         discretization = self.discretization
         bc_types = self.bc_types
-        bc_functions = self.bc_functions
+        if bc_functions is None:
+            bc_functions = self.bc_functions
         vert_coords = np.array([grid.xy_vert[ev] for ev in belem_vertices])
         # get bc
         bc_type = bc_types[lb]
@@ -562,79 +1241,209 @@ class NaturalBoundary():
             b_elem[j] = discretization.integrate_element(integrand, True)
         return b_elem
 
-    def assemble_natural_boundary_vector(self):
-        """Operates on vertices."""
+    def assemble_natural_boundary_vector(self, bc_functions=None):
+        """Operates on vertices.
+
+        Other boundary functions than those of the operator can be given, eg the boundary functions
+        at another time for time-dependent boundary conditions.
+        """
         grid = self.grid
-        b = np.zeros(len(grid.xy_vert))
-        # loop over boundary elements
-        for i, xy_i in enumerate(grid.xy_bound):
-            # xy_i is center of current boundary element
-            belem_vertices = grid.belmat[i]
-            lb = grid.loc_bound[i]
-            b_elem = self.generate_natural_boundary_term(belem_vertices, lb)
-            # assign contributions from boundary element i to every connected vertex (only 1 in 1D)
-            for j in range(len(belem_vertices)):
-                # each boundary vertex is associated with one test function (in 1D),
-                # which is associated with one equation
-                b[grid.belmat[i, j]] += b_elem[j]
-                # grid.belmat[i,j] is the index of the vertex/test function/equation
+        if self.discretization.quadrature == "reference":
+            b_elem = np.array([self.generate_natural_boundary_term(belem_vertices, grid.bound_labels[code], bc_functions)
+                               for belem_vertices, code in zip(grid.belmat, grid.loc_bound)])
+        else:
+            b_elem = self.generate_natural_boundary_terms(bc_functions)
+        # assign contributions from each boundary element to every connected vertex (only 1 in 1D)
+        # each boundary vertex is associated with one test function (in 1D), which is associated
+        # with one equation
+        b = np.bincount(grid.belmat.ravel(), weights=b_elem.ravel(), minlength=len(grid.xy_vert))
         return b
 
+    def generate_natural_boundary_terms(self, bc_functions=None):
+        """Natural boundary terms of all boundary elements, as array of shape (n_belem, k).
+
+        The boundary functions are evaluated once per boundary label, at the quadrature points of all
+        boundary elements with that label.
+        """
+        if bc_functions is None:
+            bc_functions = self.bc_functions
+        grid = self.grid
+        discretization = self.discretization
+        tabulation = discretization.get_tabulation(discretization.dim - 1, discretization.degree)
+        vert_coords = grid.get_boundary_element_coordinates()
+        det = discretization.get_boundary_determinants(vert_coords)
+        xy = discretization.map_points(vert_coords, tabulation)
+        b_elem = np.zeros(grid.belmat.shape)
+        for lb, belems in grid.boundary_elements.items():
+            if len(belems) > 0:
+                b_elem[belems] = self.integrate_boundary_elements(det[belems], xy[belems], tabulation,
+                                                                  self.bc_types[lb], bc_functions[lb])
+        return b_elem
+
+    def integrate_boundary_elements(self, det, xy, tabulation, bc_type, bc_function):
+        """Natural boundary terms of a batch of boundary elements with the same boundary condition,
+        with quadrature points xy of shape (n_belem, nq, dim)."""
+        # the boundary terms are zero for operators without integration by parts
+        return np.zeros((len(det), tabulation.v.shape[1]))
+
 
 class Diffusion(SolutionOperator, NaturalBoundary):
-    # -D*u_xx
+    # -(D*u_x)_x
     # weak form:
     # -[D*(du/dx)*v]_0^L + \int_0^L D*(du/dx)*(dv/dx) dx
-    def __init__(self, grid, discretization, bc_types, bc_functions, D):
+    degree = 0  # polynomial degree of integrand, for linear basis functions
+
+    def __init__(self, grid, discretization, bc_types, bc_functions, D, assemble=True):
         self.grid = grid
         self.discretization = discretization
         self.bc_types = bc_types
         self.bc_functions = bc_functions
         self.coeff = D
-        self.s = self.assemble_stiffness_matrix()
-        self.b_nat = self.assemble_natural_boundary_vector()
+        self.linear_systems = {}
+        self.element_data = None
+        if assemble:
+            self.s = self.assemble_stiffness_matrix()
+            self.b_nat = self.assemble_natural_boundary_vector()
 
     def generate_integrand(self, test_function, basis_function, dvjdxy, dphikdxy, det, vert_coords):
-        """Generate integrand for diffusion.
+        """Generate integrand for diffusion with unit coefficient.
 
         This is only one of the integrands, for one of the combinations of test and basis
         functions.
         """
-        integrand = lambda xieta: self.coeff*(np.dot(dvjdxy, dphikdxy)).item()*det
+        integrand = lambda xieta: (np.dot(dvjdxy, dphikdxy)).item()*det
         return integrand
 
+    def integrate_elements(self, det, dvdxy, dphidxy, coeff=None, tabulation=None):
+        """Integrate diffusion for all elements and all combinations of test and basis functions,
+        with unit coefficient, or with coefficient values coeff at the points of tabulation.
+
+        The gradients are constant over each element, so the integral is their product times the
+        integral of the coefficient over the element.
+        """
+        if coeff is None:
+            discretization = self.discretization
+            tabulation = discretization.get_tabulation(discretization.dim, self.degree)
+            weights = det*tabulation.weights.sum()
+        else:
+            weights = det*(coeff @ tabulation.weights)
+        s_elem = np.einsum('ejd,ekd->ejk', dvdxy, dphidxy)*weights[:, None, None]
+        return s_elem
+
+    def apply(self, u):
+        """Return s @ u without assembling s.
+
+        The gradient of u is gathered per element from the gradients of the basis functions, and the
+        flux D*grad(u) is scattered to the vertices through the gradients of the test functions.
+        The gradients, with those of the test functions multiplied by the integral of D over the
+        element, are kept as element data, which takes O(n) memory. They are stored with the
+        elements along the last axis, which makes the products faster.
+        """
+        elmat, dphidxy, dvdxy = self.get_element_data()
+        grad = np.einsum('ke,dke->de', u[elmat], dphidxy)
+        y_elem = np.einsum('dje,de->je', dvdxy, grad)
+        return np.bincount(elmat.ravel(), weights=y_elem.ravel(), minlength=len(u))
+
+    def generate_element_data(self):
+        grid = self.grid
+        vert_coords = grid.get_element_coordinates()
+        det, dphidxy, dvdxy = self.discretization.get_element_geometry(vert_coords)
+        coeff_q, tabulation = self.get_element_coefficients(vert_coords)
+        weights = det*(coeff_q @ tabulation.weights)
+        return (np.ascontiguousarray(grid.elmat.T), np.ascontiguousarray(dphidxy.transpose(2, 1, 0)),
+                np.ascontiguousarray((weights[:, None, None]*dvdxy).transpose(2, 1, 0)))
+
     def generate_boundary_integrand(self, test_function, vert_coords, bc_type, bc_function):
         # Since we reduce the order of the diffusion operator through integration by parts,
         # boundary terms appear, which must be added to the equation.
         # since this term will be added to right-hand side, it gets a minus sign
         discretization = self.discretization
-        # transform bc_function to function of xieta
+        bc_function = discretization.get_point_function(bc_function)
+        coefficient = discretization.get_point_function(self.get_coefficient_function(self.coeff))
+        # transform bc_function and coefficient to functions of xieta
         bc_function_xieta, det = discretization.coordinate_transformation_bound(vert_coords, bc_function)
+        coefficient_xieta, det = discretization.coordinate_transformation_bound(vert_coords, coefficient)
         if bc_type == "neumann":
-            integrand = lambda xieta: self.coeff*bc_function_xieta(xieta)*test_function(xieta)*det
+            integrand = lambda xieta: coefficient_xieta(xieta)*bc_function_xieta(xieta)*test_function(xieta)*det
         else:
             integrand = lambda xieta: 0
         return integrand
 
+    def integrate_boundary_elements(self, det, xy, tabulation, bc_type, bc_function):
+        b_elem = np.zeros((len(det), tabulation.v.shape[1]))
+        if bc_type == "neumann":
+            g = self.discretization.evaluate_function(bc_function, xy.reshape(-1, xy.shape[-1]))
+            g = g.reshape(xy.shape[:-1])
+            if self.is_constant(self.coeff):
+                b_elem = self.coeff*np.einsum('e,q,eq,qj->ej', det, tabulation.weights, g, tabulation.v)
+            else:
+                # the flux through the boundary is D*du/dn
+                coeff = self.evaluate_coefficient(self.coeff, xy)
+                b_elem = np.einsum('e,q,eq,qj->ej', det, tabulation.weights, coeff*g, tabulation.v)
+        return b_elem
+
 
 class Reaction(SolutionOperator, NaturalBoundary):
     # R*u
     # weak form:
     # \int_0^L R*u*v dx
-    def __init__(self, grid, discretization, bc_types, bc_functions, R):
+    # with lumped=True, each element matrix is replaced by the diagonal matrix of its row sums, so
+    # the matrix is diagonal, with the integrals of R*v_i on the diagonal
+    degree = 2  # polynomial degree of integrand, for linear basis functions
+
+    def __init__(self, grid, discretization, bc_types, bc_functions, R, assemble=True, lumped=False):
         self.grid = grid
         self.discretization = discretization
         self.bc_types = bc_types
         self.bc_functions = bc_functions
         self.coeff = R
-        self.s = self.assemble_stiffness_matrix()
-        self.b_nat = self.assemble_natural_boundary_vector()
+        self.linear_systems = {}
+        self.element_data = None
+        self.lumped = lumped
+        if assemble:
+            self.s = self.assemble_stiffness_matrix()
+            self.b_nat = self.assemble_natural_boundary_vector()
 
     def generate_integrand(self, test_function, basis_function, dvjdxy, dphikdxy, det, vert_coords):
-        """Generate integrand for reaction."""
-        integrand = lambda xieta: self.coeff*test_function(xieta)*basis_function(xieta)*det
+        """Generate integrand for reaction with unit coefficient."""
+        integrand = lambda xieta: test_function(xieta)*basis_function(xieta)*det
         return integrand
 
+    def get_name(self):
+        return "LumpedReaction" if self.lumped else "Reaction"
+
+    def integrate_elements(self, det, dvdxy, dphidxy, coeff=None, tabulation=None):
+        """Integrate reaction for all elements and all combinations of test and basis functions,
+        with unit coefficient, or with coefficient values coeff at the points of tabulation.
+
+        For unit coefficient, the integral over the reference element is the same for all elements,
+        and is scaled by the determinant of each element.
+        """
+        if coeff is None:
+            discretization = self.discretization
+            tabulation = discretization.get_tabulation(discretization.dim, self.degree)
+            s_ref = np.einsum('q,qj,qk->jk', tabulation.weights, tabulation.v, tabulation.phi)
+            s_elem = det[:, None, None]*s_ref
+        else:
+            s_q = np.einsum('q,qj,qk->qjk', tabulation.weights, tabulation.v, tabulation.phi)
+            s_elem = det[:, None, None]*np.einsum('eq,qjk->ejk', coeff, s_q)
+        if self.lumped:
+            s_elem = self.lump_element_matrices(s_elem)
+        return s_elem
+
+    def lump_element_matrices(self, s_elem):
+        """Replace element matrices of shape (..., k, k) by the diagonal matrices of their row sums."""
+        s_lumped = np.zeros_like(s_elem)
+        k = s_elem.shape[-1]
+        s_lumped[..., range(k), range(k)] = s_elem.sum(axis=-1)
+        return s_lumped
+
+    def generate_element_matrix(self, elem_vertices, coefficient=None):
+        s_elem = super().generate_element_matrix(elem_vertices, coefficient)
+        if self.lumped:
+            s_elem = self.lump_element_matrices(s_elem)
+        return s_elem
+
     def generate_boundary_integrand(self, test_function, vert_coords, bc_type, bc_function):
         # the boundary terms are zero for the reaction operator, since there is no integration by parts
         integrand = lambda xieta: 0
@@ -645,39 +1454,308 @@ class Advection(SolutionOperator, NaturalBoundary):
     # A*u_x
     # weak form:
     # \int_0^L A*(du/dx)*v dx
-    def __init__(self, grid, discretization, bc_types, bc_functions, A):
+    degree = 1  # polynomial degree of integrand, for linear basis functions
+
+    def __init__(self, grid, discretization, bc_types, bc_functions, A, assemble=True):
         self.grid = grid
         self.discretization = discretization
         self.bc_types = bc_types
         self.bc_functions = bc_functions
         self.coeff = A
-        self.s = self.assemble_stiffness_matrix()
-        self.b_nat = self.assemble_natural_boundary_vector()
+        self.linear_systems = {}
+        self.element_data = None
+        if assemble:
+            self.s = self.assemble_stiffness_matrix()
+            self.b_nat = self.assemble_natural_boundary_vector()
 
     def generate_integrand(self, test_function, basis_function, dvjdxy, dphikdxy, det, vert_coords):
-        """Generate integrand for linear advection."""
-        integrand = lambda xieta: self.coeff*dphikdxy.item()*test_function(xieta)*det
+        """Generate integrand for linear advection with unit coefficient."""
+        # advection in x-direction
+        integrand = lambda xieta: dphikdxy[0]*test_function(xieta)*det
         return integrand
 
+    def integrate_elements(self, det, dvdxy, dphidxy, coeff=None, tabulation=None):
+        """Integrate linear advection for all elements and all combinations of test and basis
+        functions, with unit coefficient, or with coefficient values coeff at the points of
+        tabulation.
+
+        The gradient of the basis function is constant over each element, so only the integral of
+        the test function (times the coefficient) over the element is needed.
+        """
+        if coeff is None:
+            discretization = self.discretization
+            tabulation = discretization.get_tabulation(discretization.dim, self.degree)
+            v_ref = np.einsum('q,qj->j', tabulation.weights, tabulation.v)
+            # advection in x-direction
+            s_elem = det[:, None, None]*np.einsum('j,ek->ejk', v_ref, dphidxy[:, :, 0])
+        else:
+            v_elem = coeff @ (tabulation.weights[:, None]*tabulation.v)
+            s_elem = det[:, None, None]*np.einsum('ej,ek->ejk', v_elem, dphidxy[:, :, 0])
+        return s_elem
+
+    def apply(self, u):
+        """Return s @ u without assembling s.
+
+        The x-derivative of u is gathered per element, and scattered to the vertices through the
+        integrals of A times the test functions over the element. These integrals and the gradients
+        are kept as element data, with the elements along the last axis, which takes O(n) memory.
+        """
+        elmat, dphidx, v_elem = self.get_element_data()
+        dudx = np.einsum('ke,ke->e', u[elmat], dphidx)
+        y_elem = v_elem*dudx
+        return np.bincount(elmat.ravel(), weights=y_elem.ravel(), minlength=len(u))
+
+    def generate_element_data(self):
+        grid = self.grid
+        vert_coords = grid.get_element_coordinates()
+        det, dphidxy, _ = self.discretization.get_element_geometry(vert_coords)
+        coeff_q, tabulation = self.get_element_coefficients(vert_coords)
+        v_elem = det[:, None]*(coeff_q @ (tabulation.weights[:, None]*tabulation.v))
+        return (np.ascontiguousarray(grid.elmat.T), np.ascontiguousarray(dphidxy[:, :, 0].T),
+                np.ascontiguousarray(v_elem.T))
+
     def generate_boundary_integrand(self, test_function, vert_coords, bc_type, bc_function):
         # the boundary terms are zero for the advection operator, since there is no integration by parts
         integrand = lambda xieta: 0
         return integrand
 
 
-class Solution():
-    def __init__(self, grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy):
+class FusedOperator(SolutionOperator, NaturalBoundary):
+    """Sum of operators, assembled in a single pass into one matrix and one boundary vector.
+
+    The operators are given as kernels, ie operators created with assemble=False. A kernel holds no
+    matrix or boundary vector of its own, and only provides its element matrices and natural
+    boundary terms, or its matrix-free product apply. The jacobians, determinants and gradients
+    are computed once per batch of elements, and shared by all kernels.
+    """
+    def __init__(self, grid, discretization, bc_types, bc_functions, operators, batch_size=10**5, assemble=True):
         self.grid = grid
         self.discretization = discretization
         self.bc_types = bc_types
         self.bc_functions = bc_functions
-        self.u = self.calculate_solution(stiffness, source, natural_boundary, xy)
+        self.operators = operators
+        self.batch_size = batch_size
+        self.linear_systems = {}
+        self.element_data = None
+        if assemble:
+            self.s = self.assemble_stiffness_matrix()
+            self.b_nat = self.assemble_natural_boundary_vector()
+
+    def assemble_stiffness_matrix(self):
+        s_elem = self.generate_element_matrices()
+        s = self.assemble_matrix(s_elem)
+        return s
 
-    def calculate_solution(self, stiffness, source, natural_boundary, xy):
+    def generate_element_matrices(self):
+        """Sum of the element matrices of all kernels, as array of shape (n_elem, k, k)."""
+        grid = self.grid
+        discretization = self.discretization
+        k = grid.elmat.shape[1]
+        if discretization.quadrature == "reference" or discretization.element_cache is not None:
+            return sum(operator.generate_element_matrices() for operator in self.operators)
+        s_elem = np.zeros((len(grid.elmat), k, k))
+        vert_coords = grid.get_element_coordinates()
+        for start in range(0, len(grid.elmat), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            det, dphidxy, dvdxy = discretization.get_element_geometry(vert_coords[batch])
+            for operator in self.operators:
+                s_elem[batch] += operator.integrate_elements_coefficient(vert_coords[batch], det, dvdxy, dphidxy,
+                                                                         operator.coeff, batch)
+        return s_elem
+
+    def generate_boundary_integrand(self, test_function, vert_coords, bc_type, bc_function):
+        # sum of the boundary integrands of all kernels, so each boundary element is visited once
+        integrands = [operator.generate_boundary_integrand(test_function, vert_coords, bc_type, bc_function)
+                      for operator in self.operators]
+        integrand = lambda xieta: sum(integrand(xieta) for integrand in integrands)
+        return integrand
+
+    def integrate_boundary_elements(self, det, xy, tabulation, bc_type, bc_function):
+        b_elem = sum(operator.integrate_boundary_elements(det, xy, tabulation, bc_type, bc_function)
+                     for operator in self.operators)
+        return b_elem
+
+
+class SolutionField():
+    """Finite element solution as function of xy, given by the coefficients c of the basis functions.
+
+    The field is evaluated lazily: values and gradients at a batch of points are found with the
+    point locator of the grid, and the barycentric coordinates of the points in their elements.
+    Points outside the grid get zero. The values at the vertices are the coefficients themselves.
+    """
+    def __init__(self, grid, discretization, c):
+        self.grid = grid
+        self.discretization = discretization
+        self.c = c
+        self.element_gradients = None
+
+    def __call__(self, points):
+        """Evaluate the solution at points of shape (n_points, dim), returning shape (n_points,)."""
+        grid = self.grid
+        points = np.asarray(points, dtype=float).reshape(-1, grid.dim)
+        # find the element containing each point, and the values of the basis functions of that
+        # element at the point (its barycentric coordinates)
+        elem, bary = grid.locate_points(points)
+        # we assume the basis functions and the rows of the elmat are ordered correspondingly
+        u = np.einsum('ek,ek->e', self.c[grid.elmat[elem]], bary)
+        u[elem < 0] = 0
+        return u
+
+    def gradient(self, points):
+        """Evaluate the gradient of the solution at points of shape (n_points, dim), returning shape
+        (n_points, dim).
+
+        The gradient is constant over each element, and is computed once for all elements.
+        """
+        grid = self.grid
+        points = np.asarray(points, dtype=float).reshape(-1, grid.dim)
+        elem, _ = grid.locate_points(points)
+        grad = self.get_element_gradients()[elem]
+        grad[elem < 0] = 0
+        return grad
+
+    def get_element_gradients(self):
+        """Return the gradient of the solution on each element, as array of shape (n_elem, dim)."""
+        if self.element_gradients is None:
+            grid = self.grid
+            _, dphidxy, _ = self.discretization.get_element_geometry(grid.get_element_coordinates())
+            self.element_gradients = np.einsum('ek,ekd->ed', self.c[grid.elmat], dphidxy)
+        return self.element_gradients
+
+    def get_nodal_values(self):
+        """Return the values at the vertices, which are the coefficients, without copying."""
+        return self.c
+
+    def sample_grid(self):
+        """Return the values at the vertices of a structured grid, with the vertex coordinates.
+
+        In 1D, these are u and x. In 2D, these are U, X and Y of shape (ny, nx), as from
+        np.meshgrid. The arrays are reshaped views of the coefficients and vertices, no data is
+        copied.
+        """
+        grid = self.grid
+        if grid.dim == 1:
+            return self.c, grid.xy_vert
+        # vertex i*ny+j is located at (x[i], y[j])
+        nx, ny = grid.shape
+        U = self.c.reshape(nx, ny).T
+        X = grid.xy_vert[:, 0].reshape(nx, ny).T
+        Y = grid.xy_vert[:, 1].reshape(nx, ny).T
+        return U, X, Y
+
+
+class ChunkedEvaluator():
+    """Evaluate a solution field at a large number of points, in chunks of fixed size.
+
+    The points are given as array of shape (n_points, dim), which can be a np.memmap of points on
+    disk, or as iterator over points or over arrays of points. Only one chunk of points is held in
+    memory at a time, so the peak memory does not depend on the number of points. The number of
+    points, the elapsed time (including reading the points and storing the results) and the
+    throughput in points per second are stored in info.
+    """
+    def __init__(self, field, chunk_size=10**5, gradient=False):
+        self.field = field
+        self.chunk_size = chunk_size
+        self.gradient = gradient  # evaluate gradients instead of values
+        self.info = {}
+
+    def evaluate(self, points):
+        """Yield the values (or gradients) at the points, chunk by chunk."""
+        self.info = {"points": 0, "time": 0.0, "points_per_second": 0.0}
+        start = time.perf_counter()
+        for chunk in self.get_chunks(points):
+            if self.gradient:
+                values = self.field.gradient(chunk)
+            else:
+                values = self.field(chunk)
+            self.update_info(len(chunk), time.perf_counter() - start)
+            yield values
+
+    def evaluate_to(self, points, out=None):
+        """Write the values (or gradients) at the points to out, chunk by chunk, and return out.
+
+        The output can be a np.memmap, of shape (n_points,) for values and (n_points, dim) for
+        gradients. Without out, an array is created, which requires the points to be an array.
+        """
+        if out is None:
+            shape = (len(points), self.field.grid.dim) if self.gradient else (len(points),)
+            out = np.empty(shape)
+        start = 0
+        for values in self.evaluate(points):
+            out[start:start + len(values)] = values
+            start += len(values)
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+    def get_chunks(self, points):
+        dim = self.field.grid.dim
+        if isinstance(points, np.ndarray):
+            # slicing a memmap only reads the chunk from disk
+            for start in range(0, len(points), self.chunk_size):
+                yield np.asarray(points[start:start + self.chunk_size], dtype=float).reshape(-1, dim)
+            return
+        buffer = []
+        n_buffer = 0
+        for item in points:
+            item = np.asarray(item, dtype=float).reshape(-1, dim)
+            buffer.append(item)
+            n_buffer += len(item)
+            if n_buffer >= self.chunk_size:
+                chunk = np.concatenate(buffer)
+                for start in range(0, n_buffer - self.chunk_size + 1, self.chunk_size):
+                    yield chunk[start:start + self.chunk_size]
+                rest = chunk[start + self.chunk_size:]
+                buffer = [rest]
+                n_buffer = len(rest)
+        if n_buffer > 0:
+            yield np.concatenate(buffer)
+
+    def update_info(self, n_points, elapsed):
+        info = self.info
+        info["points"] += n_points
+        info["time"] = elapsed
+        if info["time"] > 0:
+            info["points_per_second"] = info["points"]/info["time"]
+
+
+class Solution():
+    def __init__(self, grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy=None,
+                 solver=None):
+        """Solve for the coefficients of the basis functions, which define the solution field.
+
+        The solution at the points xy is evaluated when u is first used. Without xy, u holds the
+        values at the vertices. Subclasses which find the coefficients otherwise pass stiffness
+        None, and no system is solved.
+        """
+        self.grid = grid
+        self.discretization = discretization
+        self.bc_types = bc_types
+        self.bc_functions = bc_functions
+        # solver for the linear system, selects a method automatically by default
+        if solver is None:
+            solver = solvers.LinearSolver()
+        self.solver = solver
+        self.xy = xy
+        self._u = None
+        # method, iterations and residual of the linear solve
+        self.solver_info = {}
+        if stiffness is not None:
+            self.field = self.calculate_solution(stiffness, source, natural_boundary)
+            self.solver_info = dict(self.linear_system.info)
+
+    @property
+    def u(self):
+        if self._u is None:
+            if self.xy is None:
+                self._u = self.field.get_nodal_values()
+            else:
+                self._u = self.construct_solution(self.grid, self.discretization, self.c, self.xy)
+        return self._u
+
+    def calculate_solution(self, stiffness, source, natural_boundary):
         grid = self.grid
         discretization = self.discretization
-        bc_types = self.bc_types
-        bc_functions = self.bc_functions
         s = stiffness.s
         d = source.d
         b_nat = natural_boundary.b_nat
@@ -688,77 +1766,62 @@ class Solution():
         # so we solve the following equation for u_0:
         # s*u_0 = d + b_nat - u*g_tilde
         # then we set up the homegenous dirichlet problem for u_0
-        # this includes setting h[idx1] = 0
-        # after linear solve the g vector is added back to the solution, to obtain u
         # below, we instead take a (equivalent) practical approach, in which we
-        # just set the values of the boundary nodes to the values of the dirichlet boundary conditions
-        # and move their contribution (in the equations for the interior nodes) to the right hand side
+        # set the values of the boundary nodes to the values of the dirichlet boundary conditions,
+        # and only solve the equations for the interior nodes, with the contribution of the boundary
+        # nodes moved to the right hand side (see solvers.LinearSystem)
 
         # g is a vector containing set values for nodes lying on dirichlet boundary
-        g = np.zeros(len(grid.xy_vert))
-        for idx0, xb in enumerate(grid.xy_bound):  # loop over boundary elements
-            lb = grid.loc_bound[idx0]
-            bc_type = bc_types[lb]
-            bc_function = bc_functions[lb]
-            for idx1 in grid.belmat[idx0]:  # loop over vertices connected to boundary element
-                xv = grid.xy_vert[idx1]  # position of vertex
-                if bc_type == "dirichlet":
-                    # set value for this boundary node
-                    bc_value = bc_function(xv)
-                    g[idx1] = bc_value
-
-        # right-hand side contains contributions from source, natural boundary conditions, and dirichlet boundary conditions
-        h = d + b_nat - np.matmul(s, g)
-        # substracting the latter term just means we move terms in the equations for the interior points to the right hand side
-        # these are the terms involving boundary points
-
-        # conduct same loop as before
-        # modify stiffness matrix and rhs vector to implement dirichlet boundary conditions
-        for idx0, xb in enumerate(grid.xy_bound):  # loop over boundary elements
-            lb = grid.loc_bound[idx0]
-            bc_type = bc_types[lb]
-            for idx1 in grid.belmat[idx0]:  # loop over vertices connected to boundary element
-                # xv = grid.xy_vert[idx1]  # position of vertex
-                if bc_type == "dirichlet":
-                    # eliminate row in stiffness matrix and replace with diagonal 1
-                    # this way we get an equation such that 1*boundary_vertex = ...
-                    s[idx1] = 0
-                    # eliminate column in stiffness matrix
-                    # this is possible because we have moved these terms to the right hand side by subtracting np.matmul(s,g) (aka forward substitution)
-                    s[:, idx1] = 0
-                    s[idx1, idx1] = 1
-                    # eliminate row in rhs
-                    # this changes the equations for the boundary vertices into 1*boundary_vertex = bc
-                    h[idx1] = g[idx1]
+        self.dirichlet = self.get_dirichlet_vertices()
+        g = self.get_dirichlet_values()
 
         # solve for solution values at vertices
         # these are actually the coefficients associated with the basis
         # functions centered at each grid point
-        c = np.linalg.solve(s, h)
-        # construct solution at arbitrary locations x, using basis functions
-        u = self.construct_solution(grid, discretization, c, xy)
-        return u
+        # the factorization of the reduced system is cached on the stiffness operator
+        self.linear_system = stiffness.get_linear_system(self.dirichlet, self.solver)
+        c = self.linear_system.solve(d + b_nat, g)
+        self.c = c
+        # the solution at arbitrary locations x is constructed from the basis functions
+        field = SolutionField(grid, discretization, c)
+        return field
+
+    def get_dirichlet_vertices(self):
+        """Return mask of the vertices lying on a dirichlet boundary."""
+        grid = self.grid
+        dirichlet = np.zeros(len(grid.xy_vert), dtype=bool)
+        for lb, vertices in grid.boundary_vertices.items():
+            if self.bc_types[lb] == "dirichlet":
+                dirichlet[vertices] = True
+        return dirichlet
+
+    def get_dirichlet_values(self, bc_functions=None):
+        """Return vector with the set values for the vertices lying on a dirichlet boundary.
+
+        A corner vertex shared by two dirichlet boundaries gets its value from the label which comes
+        last in grid.bound_labels (in 2D: bottom and top take precedence over left and right).
+        Each vertex is evaluated once.
+        """
+        if bc_functions is None:
+            bc_functions = self.bc_functions
+        grid = self.grid
+        g = np.zeros(len(grid.xy_vert))
+        xy_vert = grid.xy_vert.reshape(len(grid.xy_vert), grid.dim)
+        assigned = np.zeros(len(grid.xy_vert), dtype=bool)
+        for lb in reversed(grid.bound_labels):
+            if self.bc_types[lb] == "dirichlet":
+                vertices = grid.boundary_vertices[lb]
+                vertices = vertices[~assigned[vertices]]
+                if len(vertices) > 0:
+                    g[vertices] = self.discretization.evaluate_function(bc_functions[lb], xy_vert[vertices])
+                    assigned[vertices] = True
+        return g
 
     def construct_solution(self, grid, discretization, c, sol_locs):
-        discretization = self.discretization
-        sol = np.zeros(len(sol_locs))
-        # loop over solution coordinates
-        for idx_sol, sol_loc in enumerate(sol_locs):
-            # loop over elements
-            for i, xy_i in enumerate(grid.xy_elem):  # xy_i is center of current element
-                elem_vertices = grid.elmat[i]
-                vert_coords = np.array([grid.xy_vert[ev] for ev in elem_vertices])
-                if discretization.check_if_point_in_element(vert_coords, sol_loc):
-                    # coordinate is in this element
-                    # get basis functions
-                    basis_functions_xieta = discretization.basis_functions
-                    basis_functions = [discretization.coordinate_transformation_inverse(vert_coords, bfx) for bfx in basis_functions_xieta]
-                    # basis_functions = discretization.coordinate_transformation_inverse(vert_coords, basis_functions_xieta)
-                    # loop over bounding vertices
-                    for j in range(grid.elmat.shape[1]):
-                        # we assume the basis functions and the rows of the elmat are ordered correspondingly
-                        sol[idx_sol] += c[grid.elmat[i, j]]*basis_functions[j](sol_loc)
-                    # due to details of the check it would be possible to double count this sol_loc
-                    # so break this loop and move on to next sol_loc
-                    break
-        return sol
+        sol_locs = np.asarray(sol_locs, dtype=float).reshape(-1, grid.dim)
+        if np.array_equal(sol_locs, grid.xy_vert.reshape(-1, grid.dim)):
+            # the coordinates are the vertices, so the solution is given by the coefficients
+            return c.copy()
+        if c is self.c:
+            return self.field(sol_locs)
+        return SolutionField(grid, discretization, c)(sol_locs)
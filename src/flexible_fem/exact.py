@@ -6,7 +6,8 @@ Created on Thu Aug 25 17:23:49 2022
 """
 
 import numpy as np
-import sympy as sp
+
+# sympy is imported in the methods which use it, since importing it is slow
 
 
 def broadcast(fun):
@@ -17,6 +18,7 @@ def broadcast(fun):
 
 class ExactSolution:
     def get_solution(self, pde, bc_types, bc_params, grid_params, core_params, source_params):
+        import sympy as sp
         if pde == 'steady_diffusion_reaction_1D':
             dim = 1
             u_sym, x_sym = self.steady_diffusion_reaction_1D(dim, bc_types, bc_params, grid_params,
@@ -64,6 +66,7 @@ class ExactSolution:
 
     def steady_diffusion_reaction_1D(self, dim, bc_types, bc_params, grid_params, core_params, source_params):
         """Diffusion-reaction equation (aka Helmholtz equation): -D*u_xx + R*u = f"""
+        import sympy as sp
         D = core_params["D"]
         R = core_params["R"]
         L = grid_params["L"]
@@ -101,6 +104,7 @@ class ExactSolution:
     def steady_advection_diffusion_reaction_1D(self, dim, bc_types, bc_params, grid_params,
                                                core_params, source_params):
         """Advection-diffusion-reaction equation: A*u_x - D*u_xx + R*u = f"""
+        import sympy as sp
         A = core_params["A"]
         D = core_params["D"]
         R = core_params["R"]
@@ -143,6 +147,7 @@ class ExactSolution:
     def steady_advection_diffusion_1D(self, dim, bc_types, bc_params, grid_params,
                                       core_params, source_params):
         """Advection-diffusion equation: A*u_x - D*u_xx = f"""
+        import sympy as sp
         A = core_params["A"]
         D = core_params["D"]
         L = grid_params["L"]
@@ -218,6 +223,7 @@ class ExactSolution:
 
     def laplace_1D(self, dim, bc_types, bc_params, grid_params, core_params, source_params):
         """Laplace equation: -D*u_xx = 0"""
+        import sympy as sp
         # D = core_params["D"]
         L = grid_params["L"]
 
@@ -267,6 +273,7 @@ class ExactSolution:
 
     def laplace_2D(self, dim, bc_types, bc_params, grid_params, core_params, source_params):
         """Laplace equation: -D*(u_xx + u_yy) = 0"""
+        import sympy as sp
         # D = core_params["D"]
         L = grid_params["L"]
         H = grid_params["H"]
@@ -8,54 +8,159 @@ Created on Thu Aug 25 12:32:48 2022
 import numpy as np
 
 from . import core
+from . import solvers
 
 
 class NumericalSolution:
-    def get_solution(self, pde, bc_types, bc_params, grid_params, core_params, source_params):
+    def get_solution(self, pde, bc_types, bc_params, grid_params, core_params, source_params,
+                     solver_params=None):
+        """Solve the given pde numerically.
+
+        The linear solver is selected automatically, unless solver_params are given, for example
+        {"method": "cg", "preconditioner": "ilu"} (see solvers.LinearSolver).
+        """
         if pde == 'steady_diffusion_reaction_1D':
             dim = 1
             u, x = self.steady_diffusion_reaction_1D(dim, bc_types, bc_params, grid_params,
-                                                     core_params, source_params)
+                                                     core_params, source_params, solver_params)
         elif pde == 'steady_advection_diffusion_reaction_1D':
             dim = 1
             u, x = self.steady_advection_diffusion_reaction_1D(dim, bc_types, bc_params, grid_params,
-                                                               core_params, source_params)
+                                                               core_params, source_params, solver_params)
         elif pde == 'steady_advection_diffusion_1D':
             dim = 1
             u, x = self.steady_advection_diffusion_1D(dim, bc_types, bc_params, grid_params,
-                                                      core_params, source_params)
+                                                      core_params, source_params, solver_params)
         elif pde == 'laplace_1D':
             dim = 1
-            u, x = self.laplace_1D(dim, bc_types, bc_params, grid_params, core_params, source_params)
+            u, x = self.laplace_1D(dim, bc_types, bc_params, grid_params, core_params, source_params,
+                                   solver_params)
         elif pde == 'laplace_2D':
             dim = 2
-            U, X, Y = self.laplace_2D(dim, bc_types, bc_params, grid_params, core_params, source_params)
+            U, X, Y = self.laplace_2D(dim, bc_types, bc_params, grid_params, core_params, source_params,
+                                      solver_params)
         if dim == 1:
             return u, x
         elif dim == 2:
             return U, X, Y
 
-    def steady_diffusion_reaction_1D(self, dim, bc_types, bc_params, grid_params, core_params, source_params):
-        """Diffusion-reaction equation (aka Helmholtz equation): -D*u_xx + R*u = f"""
-        D = core_params["D"]
-        R = core_params["R"]
-        L = grid_params["L"]
-        n = grid_params["n"]
-        source_function = source_params["function"]
-        alpha = source_params["alpha"]
-        beta = source_params["beta"]
-        gamma = source_params["gamma"]
+    def get_solution_sweep(self, pde, bc_types, bc_params, grid_params, core_params, source_params,
+                           solver_params=None):
+        """Solve the given pde for a sweep over the coefficients in core_params.
+
+        The values in core_params are arrays of equal length, or scalars which are used for every
+        solve. Since the stiffness matrix is linear in the coefficients, S = A*C + D*K + R*M, the
+        matrices C, K and M for unit coefficients are assembled only once (and cached on the grid),
+        and each solve only needs a sparse linear combination of them.
+        Returns the stacked solutions, of shape (n_sweep, n) and x in 1D, and of shape
+        (n_sweep, ny, nx) and X, Y in 2D.
+        """
+        # coefficients of the operators in each pde
+        pde_coefficients = {
+            'steady_diffusion_reaction_1D': ["D", "R"],
+            'steady_advection_diffusion_reaction_1D': ["A", "D", "R"],
+            'steady_advection_diffusion_1D': ["A", "D"],
+            'laplace_1D': ["D"],
+            'laplace_2D': ["D"]
+        }
+        operator_types = {
+            "A": core.Advection,
+            "D": core.Diffusion,
+            "R": core.Reaction
+        }
+        names = pde_coefficients[pde]
+        coefficients = np.broadcast_arrays(*[np.atleast_1d(core_params[name]) for name in names])
+
+        if pde == 'laplace_2D':
+            dim = 2
+            grid = core.Grid(dim, grid_params["L"], grid_params["nx"], grid_params["H"], grid_params["ny"])
+        else:
+            dim = 1
+            grid = core.Grid(dim, grid_params["L"], grid_params["n"])
 
-        if source_function == "periodic":
+        discretization = core.Discretization(dim)
+
+        if pde in ['laplace_1D', 'laplace_2D']:
+            # zero source term, as in the laplace methods
+            source_params = {"function": "zero"}
+        f = self.get_source_function(source_params)
+        source = core.Source(grid, discretization, f)
+
+        bc_functions = self.get_bc_functions(bc_params)
+
+        solver = self.get_solver(solver_params)
+
+        # return the solution at the vertices
+        xy = grid.xy_vert
+        u = np.zeros((len(coefficients[0]), len(xy)))
+        for i in range(len(coefficients[0])):
+            # the operator matrices are scaled copies of the cached unit matrices
+            operators = [operator_types[name](grid, discretization, bc_types, bc_functions, coeff[i])
+                         for name, coeff in zip(names, coefficients)]
+            stiffness = core.SolutionOperator(grid, discretization, operators)
+            natural_boundary = core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+            solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source,
+                                     natural_boundary, xy, solver)
+            u[i] = solution.u
+
+        if dim == 1:
+            return u, grid.xy_vert
+        elif dim == 2:
+            # vertex i*ny+j is located at (x[i], y[j])
+            nx, ny = grid.shape
+            U = u.reshape(len(u), nx, ny).transpose(0, 2, 1)
+            X = grid.xy_vert[:, 0].reshape(nx, ny).transpose()
+            Y = grid.xy_vert[:, 1].reshape(nx, ny).transpose()
+            return U, X, Y
+
+    def get_source_function(self, source_params):
+        if source_params["function"] == "periodic":
             # periodic source term:
-            # xy is a list, with xy[0] = x
+            # xy is an array of points of shape (n_points, dim), with x in xy[:, 0]
             # this is done for generality, so that the code works for 1D and 2D
-            f = lambda xy: alpha + beta*np.sin(gamma*xy[0])
-
+            alpha = source_params["alpha"]
+            beta = source_params["beta"]
+            gamma = source_params["gamma"]
+            f = lambda xy: alpha + beta*np.sin(gamma*xy[:, 0])
+        elif source_params["function"] == "zero":
+            # zero source term:
+            f = lambda xy: 0
+        return f
+
+    def get_bc_functions(self, bc_params):
         bc_functions = {}
         for lb in bc_params:
             if bc_params[lb][0] == "constant":
                 bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1]
+            elif bc_params[lb][0] == "quadratic":
+                if lb == "left" or lb == "right":
+                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*(xy[:, 1]-bc_params[lb][3]) + bc_params[lb][4]*(xy[:, 1]-bc_params[lb][5])**2
+                elif lb == "bottom" or lb == "top":
+                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*(xy[:, 0]-bc_params[lb][3]) + bc_params[lb][4]*(xy[:, 0]-bc_params[lb][5])**2
+            elif bc_params[lb][0] == "sine":
+                if lb == "left" or lb == "right":
+                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*np.sin(bc_params[lb][3]*xy[:, 1])
+                elif lb == "bottom" or lb == "top":
+                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*np.sin(bc_params[lb][3]*xy[:, 0])
+        return bc_functions
+
+    def get_solver(self, solver_params):
+        if solver_params is None:
+            solver_params = {}
+        solver = solvers.LinearSolver(**solver_params)
+        return solver
+
+    def steady_diffusion_reaction_1D(self, dim, bc_types, bc_params, grid_params, core_params, source_params,
+                                     solver_params=None):
+        """Diffusion-reaction equation (aka Helmholtz equation): -D*u_xx + R*u = f"""
+        D = core_params["D"]
+        R = core_params["R"]
+        L = grid_params["L"]
+        n = grid_params["n"]
+
+        f = self.get_source_function(source_params)
+
+        bc_functions = self.get_bc_functions(bc_params)
 
         # weak form:
         # -[D*(du/dx)*v]_0^L + \int_0^L D*(du/dx)*(dv/dx) dx + \int_0^L R*u*v dx = \int_0^L f*v dx
@@ -84,46 +189,40 @@ class NumericalSolution:
 
         source = core.Source(grid, discretization, f)
 
-        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D)
+        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False)
 
-        reaction = core.Reaction(grid, discretization, bc_types, bc_functions, R)
+        reaction = core.Reaction(grid, discretization, bc_types, bc_functions, R, assemble=False)
 
+        # assemble all operators in a single pass, into one matrix and one natural boundary vector
         operators = [diffusion, reaction]
-        stiffness = core.SolutionOperator(grid, discretization, operators)
+        stiffness = core.FusedOperator(grid, discretization, bc_types, bc_functions, operators)
         # print(stiffness.s)
 
-        natural_boundary = core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+        natural_boundary = stiffness
 
         # specify points at which to return function:
         x_vec = np.linspace(0, L, n)
-        xy = [[x] for x in x_vec]
+        xy = x_vec[:, None]
 
-        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+        solver = self.get_solver(solver_params)
+        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy,
+                                 solver)
         u = solution.u
 
         return u, x_vec
 
     def steady_advection_diffusion_reaction_1D(self, dim, bc_types, bc_params, grid_params,
-                                               core_params, source_params):
+                                               core_params, source_params, solver_params=None):
         """Advection-diffusion-reaction equation: A*u_x - D*u_xx + R*u = f"""
         A = core_params["A"]
         D = core_params["D"]
         R = core_params["R"]
         L = grid_params["L"]
         n = grid_params["n"]
-        source_function = source_params["function"]
-        alpha = source_params["alpha"]
-        beta = source_params["beta"]
-        gamma = source_params["gamma"]
 
-        if source_function == "periodic":
-            # periodic source term:
-            f = lambda xy: alpha + beta*np.sin(gamma*xy[0])
+        f = self.get_source_function(source_params)
 
-        bc_functions = {}
-        for lb in bc_params:
-            if bc_params[lb][0] == "constant":
-                bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1]
+        bc_functions = self.get_bc_functions(bc_params)
 
         # weak form:
         # \int_0^L A*(du/dx)*v dx - [D*(du/dx)*v]_0^L + \int_0^L D*(du/dx)*(dv/dx) dx
@@ -136,47 +235,41 @@ class NumericalSolution:
         source = core.Source(grid, discretization, f)
         # print(source.d)
 
-        advection = core.Advection(grid, discretization, bc_types, bc_functions, A)
+        advection = core.Advection(grid, discretization, bc_types, bc_functions, A, assemble=False)
 
-        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D)
+        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False)
 
-        reaction = core.Reaction(grid, discretization, bc_types, bc_functions, R)
+        reaction = core.Reaction(grid, discretization, bc_types, bc_functions, R, assemble=False)
 
+        # assemble all operators in a single pass, into one matrix and one natural boundary vector
         operators = [advection, diffusion, reaction]
-        stiffness = core.SolutionOperator(grid, discretization, operators)
+        stiffness = core.FusedOperator(grid, discretization, bc_types, bc_functions, operators)
         # print(stiffness.s)
 
-        natural_boundary = core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+        natural_boundary = stiffness
 
         # specify points at which to return function:
         x_vec = np.linspace(0, L, n)
-        xy = [[x] for x in x_vec]
+        xy = x_vec[:, None]
 
-        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+        solver = self.get_solver(solver_params)
+        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy,
+                                 solver)
         u = solution.u
 
         return u, x_vec
 
     def steady_advection_diffusion_1D(self, dim, bc_types, bc_params, grid_params,
-                                      core_params, source_params):
+                                      core_params, source_params, solver_params=None):
         """Advection-diffusion equation: A*u_x - D*u_xx = f"""
         A = core_params["A"]
         D = core_params["D"]
         L = grid_params["L"]
         n = grid_params["n"]
-        source_function = source_params["function"]
-        alpha = source_params["alpha"]
-        beta = source_params["beta"]
-        gamma = source_params["gamma"]
 
-        if source_function == "periodic":
-            # periodic source term:
-            f = lambda xy: alpha + beta*np.sin(gamma*xy[0])
+        f = self.get_source_function(source_params)
 
-        bc_functions = {}
-        for lb in bc_params:
-            if bc_params[lb][0] == "constant":
-                bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1]
+        bc_functions = self.get_bc_functions(bc_params)
 
         # weak form:
         # \int_0^L A*(du/dx)*v dx - [D*(du/dx)*v]_0^L + \int_0^L D*(du/dx)*(dv/dx) dx
@@ -189,38 +282,39 @@ class NumericalSolution:
         source = core.Source(grid, discretization, f)
         # print(source.d)
 
-        advection = core.Advection(grid, discretization, bc_types, bc_functions, A)
+        advection = core.Advection(grid, discretization, bc_types, bc_functions, A, assemble=False)
 
-        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D)
+        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False)
 
+        # assemble all operators in a single pass, into one matrix and one natural boundary vector
         operators = [advection, diffusion]
-        stiffness = core.SolutionOperator(grid, discretization, operators)
+        stiffness = core.FusedOperator(grid, discretization, bc_types, bc_functions, operators)
         # print(stiffness.s)
 
-        natural_boundary = core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+        natural_boundary = stiffness
 
         # specify points at which to return function:
         x_vec = np.linspace(0, L, n)
-        xy = [[x] for x in x_vec]
+        xy = x_vec[:, None]
 
-        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+        solver = self.get_solver(solver_params)
+        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy,
+                                 solver)
         u = solution.u
 
         return u, x_vec
 
-    def laplace_1D(self, dim, bc_types, bc_params, grid_params, core_params, source_params):
+    def laplace_1D(self, dim, bc_types, bc_params, grid_params, core_params, source_params,
+                   solver_params=None):
         """Laplace equation: - D*u_xx = 0"""
         D = core_params["D"]
         L = grid_params["L"]
         n = grid_params["n"]
 
         # zero source term:
-        f = lambda xy: 0
+        f = self.get_source_function({"function": "zero"})
 
-        bc_functions = {}
-        for lb in bc_params:
-            if bc_params[lb][0] == "constant":
-                bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1]
+        bc_functions = self.get_bc_functions(bc_params)
 
         # weak form:
         # - [D*(du/dx)*v]_0^L + \int_0^L D*(du/dx)*(dv/dx) dx  = 0
@@ -231,24 +325,27 @@ class NumericalSolution:
 
         source = core.Source(grid, discretization, f)
 
-        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D)
+        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False)
 
         operators = [diffusion]
-        stiffness = core.SolutionOperator(grid, discretization, operators)
+        stiffness = core.FusedOperator(grid, discretization, bc_types, bc_functions, operators)
         # print(stiffness.s)
 
-        natural_boundary = core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+        natural_boundary = stiffness
 
         # specify points at which to return function:
         x_vec = np.linspace(0, L, n)
-        xy = [[x] for x in x_vec]
+        xy = x_vec[:, None]
 
-        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+        solver = self.get_solver(solver_params)
+        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy,
+                                 solver)
         u = solution.u
 
         return u, x_vec
 
-    def laplace_2D(self, dim, bc_types, bc_params, grid_params, core_params, source_params):
+    def laplace_2D(self, dim, bc_types, bc_params, grid_params, core_params, source_params,
+                   solver_params=None):
         """Laplace equation: - D*(u_xx + u_yy) = 0"""
 
         # weak form:
@@ -261,22 +358,9 @@ class NumericalSolution:
         ny = grid_params["ny"]
 
         # zero source term:
-        f = lambda xy: 0
+        f = self.get_source_function({"function": "zero"})
 
-        bc_functions = {}
-        for lb in bc_params:
-            if bc_params[lb][0] == "constant":
-                bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1]
-            elif bc_params[lb][0] == "quadratic":
-                if lb == "left" or lb == "right":
-                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*(xy[1]-bc_params[lb][3]) + bc_params[lb][4]*(xy[1]-bc_params[lb][5])**2
-                elif lb == "bottom" or lb == "top":
-                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*(xy[0]-bc_params[lb][3]) + bc_params[lb][4]*(xy[0]-bc_params[lb][5])**2
-            elif bc_params[lb][0] == "sine":
-                if lb == "left" or lb == "right":
-                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*np.sin(bc_params[lb][3]*xy[1])
-                elif lb == "bottom" or lb == "top":
-                    bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1] + bc_params[lb][2]*np.sin(bc_params[lb][3]*xy[0])
+        bc_functions = self.get_bc_functions(bc_params)
 
         grid = core.Grid(dim, L, nx, H, ny)
 
@@ -284,26 +368,19 @@ class NumericalSolution:
 
         source = core.Source(grid, discretization, f)
 
-        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D)
+        diffusion = core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False)
 
         operators = [diffusion]
-        stiffness = core.SolutionOperator(grid, discretization, operators)
+        stiffness = core.FusedOperator(grid, discretization, bc_types, bc_functions, operators)
         # print(stiffness.s)
 
-        natural_boundary = core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+        natural_boundary = stiffness
 
-        # specify points at which to return function:
-        x_vec = np.linspace(0, L, nx)
-        y_vec = np.linspace(0, H, ny)
-        xy = np.array([[x, y] for x in x_vec for y in y_vec])
-        # X, Y = np.meshgrid(x_vec, y_vec)
-
-        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
-        u = solution.u
+        solver = self.get_solver(solver_params)
+        solution = core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary,
+                                 solver=solver)
 
-        # Create meshgrid and get solution on meshgrid:
-        X = np.array([coord[0] for coord in xy]).reshape(x_vec.shape[0], y_vec.shape[0]).transpose()
-        Y = np.array([coord[1] for coord in xy]).reshape(x_vec.shape[0], y_vec.shape[0]).transpose()
-        U = np.array([sol for sol in u]).reshape(x_vec.shape[0], y_vec.shape[0]).transpose()
+        # the solution on the meshgrid of the vertices
+        U, X, Y = solution.field.sample_grid()
 
         return U, X, Y
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Time series of solutions, streamed to and read from memory-mapped files.
+
+@author: jfhbuist
+"""
+
+import os
+
+import numpy as np
+
+from . import core
+
+
+class TimeSeriesWriter:
+    """Write snapshots (step, t, c) of a transient solution to a directory of .npy files.
+
+    The values are stored in values.npy, of shape (capacity, n_vertices), which is preallocated and
+    memory-mapped, so only the snapshot being written is held in memory. The step and time of each
+    snapshot are stored in steps.npy and times.npy, and the grid in grid.npz. Times of snapshots
+    which are not written yet are NaN, so a run can be read while it is written, or after it was
+    interrupted. The writer can be passed as callback to the solve method of a transient solution.
+    """
+    def __init__(self, path, grid, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, "grid.npz"), dim=grid.dim, shape=grid.shape, size=grid.size,
+                 xy_vert=grid.xy_vert, elmat=grid.elmat)
+        open_memmap = np.lib.format.open_memmap
+        self.values = open_memmap(os.path.join(path, "values.npy"), mode="w+", dtype=float,
+                                  shape=(capacity, len(grid.xy_vert)))
+        self.steps = open_memmap(os.path.join(path, "steps.npy"), mode="w+", dtype=np.int64, shape=(capacity,))
+        self.times = open_memmap(os.path.join(path, "times.npy"), mode="w+", dtype=float, shape=(capacity,))
+        self.times[:] = np.nan
+
+    def __call__(self, step, t, c):
+        self.write(step, t, c)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def write(self, step, t, c):
+        if self.count == self.capacity:
+            raise ValueError(f"Time series is full, its capacity is {self.capacity} snapshots.")
+        self.values[self.count] = c
+        self.steps[self.count] = step
+        # the time is written last, as it marks the snapshot as complete
+        self.times[self.count] = t
+        self.count += 1
+
+    def flush(self):
+        for array in [self.values, self.steps, self.times]:
+            array.flush()
+
+
+class TimeSeriesReader:
+    """Read a time series written by TimeSeriesWriter.
+
+    The values are opened as memory map, so indexing or slicing the reader, or selecting a range of
+    times, only reads the requested snapshots from disk. The times and steps of the written
+    snapshots are read on opening.
+    """
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, "grid.npz")) as header:
+            self.header = {key: header[key] for key in header.files}
+        times = np.load(os.path.join(path, "times.npy"), mmap_mode="r")
+        # snapshots are written in order, so the written snapshots come before the first NaN
+        written = np.isnan(times)
+        self.count = int(np.argmax(written)) if np.any(written) else len(times)
+        self.times = np.array(times[:self.count])
+        self.steps = np.array(np.load(os.path.join(path, "steps.npy"), mmap_mode="r")[:self.count])
+        self.values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def get_grid(self):
+        """Create the grid on which the time series was computed."""
+        dim = int(self.header["dim"])
+        size = self.header["size"]
+        shape = self.header["shape"]
+        if dim == 1:
+            grid = core.Grid(1, size[0], int(shape[0]))
+        else:
+            grid = core.Grid(2, size[0], int(shape[0]), size[1], int(shape[1]))
+        return grid
+
+    def get_time_range(self, t_start, t_end):
+        """Return the times and values of the snapshots with t_start <= t <= t_end.
+
+        The values are a slice of the memory map, which is read from disk when it is used.
+        """
+        start = np.searchsorted(self.times, t_start, side="left")
+        end = np.searchsorted(self.times, t_end, side="right")
+        return self.times[start:end], self.values[start:end]
+
+    def get_field(self, index, discretization=None):
+        """Return the solution field of a snapshot."""
+        grid = self.get_grid()
+        if discretization is None:
+            discretization = core.Discretization(grid.dim)
+        return core.SolutionField(grid, discretization, np.array(self.values[index]))
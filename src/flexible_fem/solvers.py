@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Linear solver backends for the discrete systems s*c = h.
+
+@author: jfhbuist
+"""
+
+import inspect
+
+import numpy as np
+import scipy as sp
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+
+
+class LinearSolver:
+    """Solve a sparse linear system with a direct or an iterative method.
+
+    Methods are "direct" (sparse LU), "banded" (O(n) solve for tridiagonal systems, such as all 1D
+    problems), "cg" (conjugate gradients, for symmetric positive definite systems), "gmres" and
+    "bicgstab" (for nonsymmetric systems, e.g. with advection). With "auto", tridiagonal systems are
+    solved banded, systems up to direct_limit unknowns directly, and larger systems with cg if they
+    are symmetric, and with gmres otherwise. Symmetric systems are factorized with a symmetric
+    ordering, which about halves the fill and time of a 2D factorization, so that the direct solve
+    is faster than cg up to a million unknowns. Preconditioners for the iterative methods are None,
+    "jacobi" and "ilu". With "auto", cg uses jacobi and the other methods use ilu.
+    After each solve, the method, number of iterations and relative residual are stored in info.
+    """
+    def __init__(self, method="auto", preconditioner="auto", tol=10**-10, maxiter=None, direct_limit=10**6):
+        self.method = method
+        self.preconditioner = preconditioner
+        self.tol = tol
+        self.maxiter = maxiter
+        self.direct_limit = direct_limit  # largest number of unknowns solved directly with "auto"
+        self.info = {}
+
+    def get_settings(self):
+        """Return the settings of this solver, which identify it in caches."""
+        return (self.method, self.preconditioner, self.tol, self.maxiter, self.direct_limit)
+
+    def solve(self, s, h):
+        s = sp.sparse.csr_matrix(s)
+        method = self.select_method(s)
+        if method == "direct":
+            preconditioner = None
+            c = self.factorize_direct(s).solve(h)
+            iterations = 0
+            converged = True
+        elif method == "banded":
+            preconditioner = None
+            c = sp.linalg.solve_banded((1, 1), self.get_banded(s), h)
+            iterations = 0
+            converged = True
+        else:
+            preconditioner = self.select_preconditioner(method)
+            m = self.get_preconditioner(s, preconditioner)
+            c, iterations, converged = self.solve_iterative(s, h, method, m)
+        h_norm = np.linalg.norm(h)
+        residual = np.linalg.norm(h - s @ c)
+        if h_norm > 0:
+            residual = residual/h_norm
+        self.info = {
+            "method": method,
+            "preconditioner": preconditioner,
+            "iterations": iterations,
+            "residual": residual,
+            "converged": converged
+        }
+        return c
+
+    def select_method(self, s):
+        if self.method == "banded" and not self.is_tridiagonal(s):
+            # the banded solver only uses the three central diagonals, other entries would be dropped
+            raise ValueError("Method banded needs a tridiagonal matrix, use method direct or auto instead.")
+        if self.method != "auto":
+            method = self.method
+        elif self.is_tridiagonal(s):
+            method = "banded"
+        elif s.shape[0] <= self.direct_limit:
+            method = "direct"
+        elif self.is_symmetric(s):
+            method = "cg"
+        else:
+            method = "gmres"
+        return method
+
+    def select_preconditioner(self, method):
+        if self.preconditioner != "auto":
+            preconditioner = self.preconditioner
+        elif method == "cg":
+            # the incomplete LU factorization is not symmetric, so it can not be used with cg, and
+            # symmetrizing it costs two triangular solves per iteration, each slower than ten
+            # matrix-vector products
+            preconditioner = "jacobi"
+        else:
+            preconditioner = "ilu"
+        return preconditioner
+
+    def is_tridiagonal(self, s):
+        s = s.tocoo()
+        return s.nnz == 0 or np.abs(s.row - s.col).max() <= 1
+
+    def get_banded(self, s):
+        """Return the three diagonals of a tridiagonal matrix, in the storage used by solve_banded."""
+        n = s.shape[0]
+        ab = np.zeros((3, n))
+        ab[0, 1:] = s.diagonal(1)  # upper
+        ab[1] = s.diagonal(0)  # main
+        ab[2, :-1] = s.diagonal(-1)  # lower
+        return ab
+
+    def is_symmetric(self, s):
+        scale = abs(s).max()
+        if scale == 0:
+            return True
+        return abs(s - s.T).max() <= 10**-12*scale
+
+    def factorize_direct(self, s):
+        """Return the sparse LU factorization of s, with a symmetric ordering if s is symmetric."""
+        if self.is_symmetric(s):
+            # a minimum degree ordering of s + s^T keeps the factors of a symmetric matrix sparse
+            permc_spec = "MMD_AT_PLUS_A"
+        else:
+            permc_spec = "COLAMD"
+        return sp.sparse.linalg.splu(sp.sparse.csc_matrix(s), permc_spec=permc_spec)
+
+    def get_preconditioner(self, s, preconditioner):
+        """Return preconditioner as linear operator approximating the inverse of s."""
+        n = s.shape[0]
+        if preconditioner is None:
+            m = None
+        elif preconditioner == "jacobi":
+            diag = s.diagonal()
+            diag_inv = 1/np.where(diag == 0, 1, diag)
+            m = sp.sparse.linalg.LinearOperator((n, n), matvec=lambda x: diag_inv*x)
+        elif preconditioner == "ilu":
+            ilu = sp.sparse.linalg.spilu(s.tocsc())
+            m = sp.sparse.linalg.LinearOperator((n, n), matvec=ilu.solve)
+        return m
+
+    def get_tolerances(self, function):
+        # the relative tolerance is called rtol in newer scipy versions, and tol in older versions
+        if "rtol" in inspect.signature(function).parameters:
+            tolerances = {"rtol": self.tol, "atol": 0.0}
+        else:
+            tolerances = {"tol": self.tol, "atol": 0.0}
+        return tolerances
+
+    def solve_iterative(self, s, h, method, m):
+        """Solve with an iterative method, and preconditioner m as returned by get_preconditioner."""
+        iterations = [0]
+
+        def count(arg):
+            iterations[0] += 1
+
+        if method == "cg":
+            function = sp.sparse.linalg.cg
+            options = {}
+        elif method == "gmres":
+            function = sp.sparse.linalg.gmres
+            # count inner iterations, the callback receives the preconditioned residual norm
+            options = {"callback_type": "pr_norm"}
+        elif method == "bicgstab":
+            function = sp.sparse.linalg.bicgstab
+            options = {}
+        c, exit_code = function(s, h, M=m, callback=count, maxiter=self.maxiter,
+                                **self.get_tolerances(function), **options)
+        converged = exit_code == 0
+        return c, iterations[0], converged
+
+
+class LinearSystem:
+    """Linear system s*c = b with c = g on the dirichlet vertices, reduced to the interior vertices.
+
+    With I the interior and B the dirichlet vertices, the reduced system is
+    s_II*c_I = b_I - s_IB*g_B. The reduced matrix is symmetric if s is symmetric. When it is solved
+    directly, its LU factorization is computed on the first solve and kept, so every further
+    right-hand side only costs a forward and back substitution. Tridiagonal systems are stored by
+    their diagonals, and each right-hand side costs an O(n) banded solve. When it is solved
+    iteratively, the preconditioner (e.g. the incomplete LU factorization) is computed on the first
+    solve and kept in the same way, and only the iterations are repeated.
+    """
+    def __init__(self, s, dirichlet, solver=None):
+        if solver is None:
+            solver = LinearSolver()
+        self.s = sp.sparse.csr_matrix(s)
+        self.dirichlet = dirichlet
+        self.interior = ~dirichlet
+        self.solver = solver
+        s_i = self.s[self.interior]
+        self.s_ii = s_i[:, self.interior]
+        self.s_ib = s_i[:, self.dirichlet]
+        self.method = solver.select_method(self.s_ii)
+        self.preconditioner = None
+        if self.method not in ["direct", "banded"]:
+            self.preconditioner = solver.select_preconditioner(self.method)
+        self.factorization = None
+        self.factorized = False
+        self.n_factorizations = 0
+        self.n_solves = 0
+        self.info = {}
+
+    def factorize(self):
+        """Return the factorization, or the preconditioner of an iterative method, computed on the
+        first call."""
+        if not self.factorized:
+            if self.method == "banded":
+                self.factorization = self.solver.get_banded(self.s_ii)
+            elif self.method == "direct":
+                self.factorization = self.solver.factorize_direct(self.s_ii)
+            else:
+                self.factorization = self.solver.get_preconditioner(self.s_ii, self.preconditioner)
+            self.factorized = True
+            self.n_factorizations += 1
+        return self.factorization
+
+    def solve(self, b, g):
+        """Solve for one right-hand side b, with dirichlet values g (both vectors of length n)."""
+        c = self.solve_many(b[:, None], g[:, None])[:, 0]
+        return c
+
+    def solve_many(self, b, g):
+        """Solve for multiple right-hand sides at once, given as columns of b and g, of shape (n, m)."""
+        b = np.asarray(b, dtype=float)
+        c = np.array(np.broadcast_to(g, b.shape), dtype=float)
+        if not np.any(self.interior):
+            return c
+        # right-hand side contains contributions from source, natural boundary conditions, and
+        # dirichlet boundary conditions
+        # substracting the latter term just means we move terms in the equations for the interior
+        # points to the right hand side, these are the terms involving boundary points
+        h = b[self.interior] - self.s_ib @ c[self.dirichlet]
+        iterations = 0
+        converged = True
+        if self.method == "banded":
+            c[self.interior] = sp.linalg.solve_banded((1, 1), self.factorize(), h)
+        elif self.method == "direct":
+            c[self.interior] = self.factorize().solve(h)
+        else:
+            m = self.factorize()
+            for j in range(h.shape[1]):
+                c[self.interior, j], iterations_j, converged_j = self.solver.solve_iterative(
+                    self.s_ii, h[:, j], self.method, m)
+                iterations += iterations_j
+                converged = converged and converged_j
+        residual = np.linalg.norm(h - self.s_ii @ c[self.interior])
+        h_norm = np.linalg.norm(h)
+        if h_norm > 0:
+            residual = residual/h_norm
+        self.info = {
+            "method": self.method,
+            "preconditioner": self.preconditioner,
+            "iterations": iterations,
+            "residual": residual,
+            "converged": converged
+        }
+        self.n_solves += h.shape[1]
+        return c
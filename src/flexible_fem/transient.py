@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+"""
+Time integration of the discrete systems M*dc/dt + S*c = h(t).
+
+@author: jfhbuist
+"""
+
+import os
+import time
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import scipy as sp
+import scipy.sparse
+
+from . import core
+from . import solvers
+
+
+class TransientSolution(core.Solution):
+    """Solution of M*dc/dt + S*c = d(t) + b_nat(t), with c = g(t) on the dirichlet vertices.
+
+    The mass matrix M is the reaction operator with unit coefficient, and S is the sum of the
+    operators, assembled once in a single pass. The source f(xy, t) and the boundary functions
+    bc_functions[lb](xy, t) depend on time. At each time they are evaluated through Source and the
+    natural boundary terms of the operators, as in the steady case.
+
+    With the theta-method, a step of size dt solves
+    (M + theta*dt*S)*c1 = (M - (1-theta)*dt*S)*c0 + dt*(theta*h1 + (1-theta)*h0),
+    with h = d + b_nat. theta = 1 gives backward Euler, and theta = 0.5 Crank-Nicolson. The matrix
+    M + theta*dt*S is factorized once per step size, and reused for all steps of that size, so the
+    default solver factorizes directly at any size. The initial condition u0 is given as function
+    of xy, or as values at the vertices.
+
+    If a Checkpoint is given as checkpoint, it is updated after each step. A solution is continued
+    from a checkpoint with resume, or by passing the state read from it, in which case u0 and t0
+    are not used.
+    """
+    def __init__(self, grid, discretization, bc_types, bc_functions, operators, f, u0, t0=0, theta=0.5,
+                 solver=None, state=None, checkpoint=None):
+        if solver is None:
+            solver = solvers.LinearSolver(direct_limit=np.inf)
+        # the coefficients follow from the initial condition, so no system is solved here
+        super().__init__(grid, discretization, bc_types, bc_functions, None, None, None, solver=solver)
+        self.f = f
+        self.theta = theta
+        self.t = t0
+        self.n_steps = 0
+        self.linear_systems = {}
+        self.checkpoint = checkpoint
+        # the operators are given as kernels, and summed in a single pass
+        bc_functions_t0 = self.get_bc_functions(t0)
+        if state is None or "stiffness_data" not in state:
+            self.stiffness = core.FusedOperator(grid, discretization, bc_types, bc_functions_t0, operators)
+            self.mass = core.Reaction(grid, discretization, bc_types, bc_functions_t0, 1)
+        else:
+            self.stiffness = core.FusedOperator(grid, discretization, bc_types, bc_functions_t0, operators,
+                                                assemble=False)
+            self.mass = core.Reaction(grid, discretization, bc_types, bc_functions_t0, 1, assemble=False)
+            self.stiffness.s = self.get_matrix(state, "stiffness")
+            self.mass.s = self.get_matrix(state, "mass")
+        self.dirichlet = self.get_dirichlet_vertices()
+        if state is None:
+            self.h = self.get_right_hand_side(t0)
+            self.set_solution(self.get_initial_values(u0))
+        else:
+            self.set_state(state)
+
+    @classmethod
+    def resume(cls, path, *args, **kwargs):
+        """Continue a transient solution from a checkpoint written by Checkpoint.
+
+        The further arguments are those with which the solution was created, and may include a
+        checkpoint to continue saving the state. The time, number of steps, coefficients and
+        right-hand side are taken from the checkpoint, and the matrices if they were saved, so the
+        steps continue exactly as they would have without interruption.
+        """
+        with np.load(path) as checkpoint:
+            state = {key: checkpoint[key] for key in checkpoint.files}
+        return cls(*args, state=state, **kwargs)
+
+    def get_state(self, matrices=True):
+        """Return the state of the time integration as dict of arrays, with the grid, and optionally
+        the matrices."""
+        grid = self.grid
+        state = {
+            "t": self.t,
+            "n_steps": self.n_steps,
+            "c": self.c,
+            "h": self.h,
+            "dim": grid.dim,
+            "shape": grid.shape,
+            "size": grid.size,
+            "xy_vert": grid.xy_vert,
+            "elmat": grid.elmat
+        }
+        if matrices:
+            for name, s in self.get_matrices().items():
+                state.update({f"{name}_data": s.data, f"{name}_indices": s.indices, f"{name}_indptr": s.indptr,
+                              f"{name}_shape": s.shape})
+        return state
+
+    def set_state(self, state):
+        grid = self.grid
+        if not (np.array_equal(state["xy_vert"], grid.xy_vert) and np.array_equal(state["elmat"], grid.elmat)):
+            raise ValueError("The state was saved for a different grid.")
+        self.t = float(state["t"])
+        self.n_steps = int(state["n_steps"])
+        self.h = state["h"]
+        self.set_solution(state["c"])
+
+    def get_matrices(self):
+        return {"mass": self.mass.s, "stiffness": self.stiffness.s}
+
+    def get_matrix(self, state, name):
+        s = sp.sparse.csr_matrix((state[f"{name}_data"], state[f"{name}_indices"], state[f"{name}_indptr"]),
+                                 shape=tuple(state[f"{name}_shape"]))
+        return s
+
+    def get_bc_functions(self, t):
+        """Return the boundary functions at time t, as functions of xy only."""
+        bc_functions = {lb: (lambda xy, bc_function=bc_function: bc_function(xy, t))
+                        for lb, bc_function in self.bc_functions.items()}
+        return bc_functions
+
+    def get_right_hand_side(self, t):
+        """Return the source and natural boundary terms at time t."""
+        f = self.f
+        source = core.Source(self.grid, self.discretization, lambda xy: f(xy, t))
+        b_nat = self.stiffness.assemble_natural_boundary_vector(self.get_bc_functions(t))
+        return source.d + b_nat
+
+    def get_initial_values(self, u0):
+        grid = self.grid
+        if callable(u0):
+            xy_vert = grid.xy_vert.reshape(len(grid.xy_vert), grid.dim)
+            c = self.discretization.evaluate_function(u0, xy_vert)
+        else:
+            c = np.array(u0, dtype=float)
+        # the initial values satisfy the dirichlet boundary conditions
+        g = self.get_dirichlet_values(self.get_bc_functions(self.t))
+        c[self.dirichlet] = g[self.dirichlet]
+        return c
+
+    def set_solution(self, c):
+        self.c = c
+        self.field = core.SolutionField(self.grid, self.discretization, c)
+        self._u = None
+
+    def get_linear_system(self, dt, theta):
+        """Return the linear system for steps of size dt, reduced for the dirichlet vertices."""
+        key = (theta, dt)
+        if key not in self.linear_systems:
+            self.linear_systems[key] = self.create_linear_system(dt, theta)
+        return self.linear_systems[key]
+
+    def create_linear_system(self, dt, theta):
+        s = self.mass.s + theta*dt*self.stiffness.s
+        return solvers.LinearSystem(s, self.dirichlet, self.solver)
+
+    def solve_step(self, dt, theta, h1, g1):
+        """Return the coefficients after a step of size dt from the current solution, given the
+        right-hand side h1 and dirichlet values g1 at the end of the step."""
+        b = (self.mass.s @ self.c - (1 - theta)*dt*(self.stiffness.s @ self.c)
+             + dt*(theta*h1 + (1 - theta)*self.h))
+        linear_system = self.get_linear_system(dt, theta)
+        c = linear_system.solve(b, g1)
+        self.solver_info = dict(linear_system.info)
+        return c
+
+    def step(self, dt):
+        """Advance the solution by one step of size dt, and return the new coefficients."""
+        t1 = self.t + dt
+        h1 = self.get_right_hand_side(t1)
+        g1 = self.get_dirichlet_values(self.get_bc_functions(t1))
+        c = self.solve_step(dt, self.theta, h1, g1)
+        self.accept_step(t1, h1, c)
+        return c
+
+    def accept_step(self, t1, h1, c):
+        self.t = t1
+        self.h = h1
+        self.n_steps += 1
+        self.set_solution(c)
+        if self.checkpoint is not None:
+            self.checkpoint.update(self)
+
+    def iterate(self, t_end, dt):
+        """Take steps of size dt until time t_end, yielding after each step.
+
+        The last step is shortened to end at t_end.
+        """
+        while t_end - self.t > 10**-12*max(abs(t_end), dt):
+            remaining = t_end - self.t
+            # a remainder which differs from dt by rounding only is taken as dt, so no new
+            # factorization is needed
+            self.step(dt if remaining > dt*(1 - 10**-9) else remaining)
+            yield
+
+    def snapshots(self, t_end, *args, every=1, threshold=None, **kwargs):
+        """Advance the solution to time t_end with the steps of iterate, which takes the further
+        arguments, and yield snapshots (step, t, c) of the solution.
+
+        Snapshots are taken at the start, after every k-th step with k = every, and at the end.
+        With a threshold, a snapshot after a step is only taken if the coefficients changed by more
+        than threshold since the last snapshot. The coefficients are not copied, as each step
+        creates a new array.
+        """
+        c_last = self.c
+        yield self.n_steps, self.t, self.c
+        for i, _ in enumerate(self.iterate(t_end, *args, **kwargs), 1):
+            if i % every != 0:
+                continue
+            if threshold is not None and np.abs(self.c - c_last).max() <= threshold:
+                continue
+            c_last = self.c
+            yield self.n_steps, self.t, self.c
+        if self.c is not c_last:
+            yield self.n_steps, self.t, self.c
+
+    def solve(self, t_end, *args, callback=None, every=1, threshold=None, **kwargs):
+        """Advance the solution to time t_end with the steps of iterate, which takes the further
+        arguments, and return the solution field.
+
+        If a callback is given, it is called as callback(step, t, c) for the snapshots described
+        in snapshots.
+        """
+        if callback is None:
+            for _ in self.iterate(t_end, *args, **kwargs):
+                pass
+        else:
+            for snapshot in self.snapshots(t_end, *args, every=every, threshold=threshold, **kwargs):
+                callback(*snapshot)
+        return self.field
+
+
+class AdaptiveTransientSolution(TransientSolution):
+    """Transient solution with adaptive step sizes, from the TR-BDF2 method and its embedded
+    error estimate.
+
+    A step of size dt is a trapezoidal (Crank-Nicolson) step to t + gamma*dt, followed by a BDF2
+    step to t + dt, with gamma = 2 - sqrt(2). Both stages solve with the same matrix
+    M + gamma/2*dt*S. The local error is estimated from the residuals r = h - S*c at the three
+    times, filtered by one more solve with this matrix, which keeps the estimate small for stiff
+    components (Hosea and Shampine, 1996). A step is accepted if the error is within
+    atol + rtol*max|c|.
+    The step sizes are restricted to dt_max/2**k for k = 0, ..., levels-1, so only a few
+    matrices occur. Their factorizations are kept in a cache of at most max_factorizations linear
+    systems, and the least recently used system is removed first. The steps which end at an
+    output time have other sizes, and their linear system is kept apart, so it does not remove a
+    reusable one from the cache. The number of accepted and rejected steps, linear solves and
+    factorizations, and the number of steps per step size are stored in stats. Steps of the
+    smallest size are accepted even if their error is above the tolerance, with a warning, and are
+    counted in stats["forced"]. A checkpoint is updated after each accepted step.
+    """
+    gamma = 2 - np.sqrt(2)
+
+    def __init__(self, grid, discretization, bc_types, bc_functions, operators, f, u0, dt_max, t0=0, levels=16,
+                 rtol=10**-3, atol=10**-6, max_factorizations=8, solver=None, state=None,
+                 checkpoint=None):
+        self.dt_max = dt_max
+        self.levels = levels
+        self.rtol = rtol
+        self.atol = atol
+        self.max_factorizations = max_factorizations
+        # start with the smallest step size, and grow
+        self.dt = dt_max/2**(levels - 1)
+        self.stats = {"accepted": 0, "rejected": 0, "forced": 0, "solves": 0, "factorizations": 0, "step_sizes": {}}
+        super().__init__(grid, discretization, bc_types, bc_functions, operators, f, u0, t0, 0.5, solver, state,
+                         checkpoint)
+        self.linear_systems = OrderedDict()
+        self.remainder_system = None
+
+    def get_state(self, matrices=True):
+        state = super().get_state(matrices)
+        stats = self.stats
+        state.update({
+            "dt": self.dt,
+            "stats": [stats["accepted"], stats["rejected"], stats["forced"], stats["solves"], stats["factorizations"]],
+            "step_sizes": list(stats["step_sizes"]),
+            "step_counts": list(stats["step_sizes"].values())
+        })
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.dt = float(state["dt"])
+        self.stats = dict(zip(["accepted", "rejected", "forced", "solves", "factorizations"], state["stats"].tolist()))
+        self.stats["step_sizes"] = dict(zip(state["step_sizes"].tolist(), state["step_counts"].tolist()))
+
+    def quantize(self, dt):
+        """Return the largest allowed step size up to dt, or the smallest allowed step size."""
+        level = np.clip(np.ceil(np.log2(self.dt_max/dt) - 10**-9), 0, self.levels - 1)
+        return self.dt_max/2**level
+
+    def get_linear_system(self, dt, theta):
+        key = (theta, dt)
+        if key in self.linear_systems:
+            self.linear_systems.move_to_end(key)
+        else:
+            self.linear_systems[key] = self.create_linear_system(dt, theta)
+            if len(self.linear_systems) > self.max_factorizations:
+                self.linear_systems.popitem(last=False)
+        return self.linear_systems[key]
+
+    def get_remainder_system(self, dt):
+        """Return the linear system for the steps to an output time, which is not cached with the
+        systems of the allowed step sizes."""
+        if self.remainder_system is None or self.remainder_system[0] != dt:
+            self.remainder_system = (dt, self.create_linear_system(dt, 0.5))
+        return self.remainder_system[1]
+
+    def solve_linear_system(self, dt, b, g):
+        """Solve (M + gamma/2*dt*S)*c = b, with c = g on the dirichlet vertices."""
+        if dt == self.quantize(dt):
+            linear_system = self.get_linear_system(self.gamma*dt, 0.5)
+        else:
+            linear_system = self.get_remainder_system(self.gamma*dt)
+        n_factorizations = linear_system.n_factorizations
+        c = linear_system.solve(b, g)
+        self.solver_info = dict(linear_system.info)
+        self.stats["solves"] += 1
+        self.stats["factorizations"] += linear_system.n_factorizations - n_factorizations
+        return c
+
+    def try_step(self, dt):
+        """Return the coefficients and right-hand side after a step of size dt, and the scaled
+        error estimate of the step."""
+        gamma = self.gamma
+        mass = self.mass.s
+        stiffness = self.stiffness.s
+        c0 = self.c
+        h0 = self.h
+        # trapezoidal stage
+        h_gamma = self.get_right_hand_side(self.t + gamma*dt)
+        g_gamma = self.get_dirichlet_values(self.get_bc_functions(self.t + gamma*dt))
+        b = mass @ c0 - gamma/2*dt*(stiffness @ c0) + gamma/2*dt*(h0 + h_gamma)
+        c_gamma = self.solve_linear_system(dt, b, g_gamma)
+        # BDF2 stage
+        h1 = self.get_right_hand_side(self.t + dt)
+        g1 = self.get_dirichlet_values(self.get_bc_functions(self.t + dt))
+        b = mass @ ((c_gamma - (1 - gamma)**2*c0)/(gamma*(2 - gamma))) + gamma/2*dt*h1
+        c1 = self.solve_linear_system(dt, b, g1)
+        # error estimate
+        k = (-3*gamma**2 + 4*gamma - 2)/(12*(2 - gamma))
+        r = (((h0 - stiffness @ c0)/gamma - (h_gamma - stiffness @ c_gamma)/(gamma*(1 - gamma))
+              + (h1 - stiffness @ c1)/(1 - gamma)))
+        e = self.solve_linear_system(dt, 2*k*dt*r, np.zeros_like(c1))
+        error = np.abs(e).max()/(self.atol + self.rtol*np.abs(c1).max())
+        return c1, h1, error
+
+    def step(self, t_end=np.inf):
+        """Advance the solution by one accepted step, not beyond t_end, and return the new
+        coefficients. Rejected steps are retried with a smaller step size.
+
+        If less than two steps of the current size remain until t_end, the remaining time is taken
+        in one step, or in two equal steps which share their matrix.
+        """
+        dt_min = self.dt_max/2**(self.levels - 1)
+        while True:
+            remaining = t_end - self.t
+            if abs(remaining - self.dt) <= 10**-9*self.dt:
+                dt = self.dt
+                t1 = t_end
+            elif remaining < self.dt:
+                dt = remaining
+                t1 = t_end
+            elif remaining < 2*self.dt:
+                # the first step ends where the second step, of size t_end - t1, starts
+                t1 = t_end - remaining/2
+                dt = t_end - t1
+            else:
+                dt = self.dt
+                t1 = self.t + dt
+            c, h, error = self.try_step(dt)
+            # the local error is of order dt**3
+            factor = np.clip(0.9*error**(-1/3), 0.2, 4) if error > 0 else 4
+            if error <= 1 or dt <= dt_min:
+                break
+            self.stats["rejected"] += 1
+            self.dt = self.quantize(min(dt*factor, dt/2))
+        if error > 1:
+            warnings.warn(f"Step of size {dt} at t = {self.t} accepted with error {error:.3g} above the "
+                          f"tolerance, at the smallest step size. Increase levels to allow smaller steps.",
+                          RuntimeWarning)
+            self.stats["forced"] += 1
+        self.stats["accepted"] += 1
+        self.stats["step_sizes"][dt] = self.stats["step_sizes"].get(dt, 0) + 1
+        if dt == self.dt:
+            self.dt = self.quantize(min(self.dt_max, dt*factor))
+        self.accept_step(t1, h, c)
+        return c
+
+    def iterate(self, t_end):
+        """Take adaptive steps until time t_end, yielding after each step."""
+        while t_end - self.t > 10**-12*max(abs(t_end), self.dt_max):
+            self.step(t_end)
+            yield
+
+
+class ExplicitTransientSolution(TransientSolution):
+    """Transient solution with explicit time stepping and the lumped mass matrix.
+
+    With the lumped (diagonal) mass matrix m, the rate dc/dt = (h - S*c)/m is computed without
+    solving a system. The operators are given as kernels, and S*c is the sum of their matrix-free
+    products apply(c), so no global matrix is assembled or stored. The methods are forward Euler
+    ("euler"), and the strong stability preserving Runge-Kutta methods of order 2 ("ssprk2") and 3
+    ("ssprk3"). The dirichlet values are set after each stage.
+
+    The stable step size follows from the eigenvalues of S/m, which are bounded by
+    rho = max_i sum_j |S_ij|/m_i (Gershgorin). For SSP-RK3 it is cfl*sqrt(3)/rho, as its stability
+    region contains the half disc of radius sqrt(3) in the left half plane, so also the complex
+    eigenvalues from advection. For forward Euler and SSP-RK2 it is cfl*2/rho, which is stable if S
+    is symmetric, or if each row of S is diagonally dominant, so that the Gershgorin discs lie in the
+    disc |1 + z| <= 1. Otherwise, as for advection dominated problems, no step size is stable for
+    all eigenvalues, and a ValueError is raised. A checkpoint is updated after each step, as in
+    TransientSolution.
+    """
+    def __init__(self, grid, discretization, bc_types, bc_functions, operators, f, u0, t0=0, method="ssprk3",
+                 cfl=0.9, state=None, checkpoint=None):
+        # no system is solved and no matrix is assembled, so only the setup of Solution is shared
+        core.Solution.__init__(self, grid, discretization, bc_types, bc_functions, None, None, None)
+        self.operators = operators
+        self.f = f
+        self.method = method
+        self.cfl = cfl
+        self.t = t0
+        self.n_steps = 0
+        self.checkpoint = checkpoint
+        self.mass = core.Reaction(grid, discretization, bc_types, self.get_bc_functions(t0), 1, assemble=False,
+                                  lumped=True)
+        self.dirichlet = self.get_dirichlet_vertices()
+        if state is None:
+            self.m = self.mass.get_row_sums()
+            self.dt_stable = self.get_stable_time_step()
+            self.h = self.get_right_hand_side(t0)
+            self.set_solution(self.get_initial_values(u0))
+        else:
+            self.set_state(state)
+
+    def get_state(self, matrices=True):
+        state = super().get_state(matrices)
+        state.update({"m": self.m, "dt_stable": self.dt_stable})
+        return state
+
+    def set_state(self, state):
+        self.m = state["m"]
+        self.dt_stable = float(state["dt_stable"])
+        super().set_state(state)
+
+    def get_matrices(self):
+        # no global matrices are assembled, the lumped mass matrix is saved as vector m
+        return {}
+
+    def get_right_hand_side(self, t):
+        """Return the source and natural boundary terms at time t."""
+        f = self.f
+        bc_functions = self.get_bc_functions(t)
+        source = core.Source(self.grid, self.discretization, lambda xy: f(xy, t))
+        b_nat = sum(operator.assemble_natural_boundary_vector(bc_functions) for operator in self.operators)
+        return source.d + b_nat
+
+    def get_stable_time_step(self):
+        """Return the largest stable step size, times the safety factor cfl."""
+        grid = self.grid
+        n = len(grid.xy_vert)
+        # the element matrices of the operators are summed first, so that opposite entries of
+        # diffusion and advection cancel in the sums of absolute values
+        s_elem = sum(operator.generate_element_matrices() for operator in self.operators)
+        row_sums = np.bincount(grid.elmat.ravel(), weights=np.abs(s_elem).sum(axis=2).ravel(), minlength=n)
+        # the dirichlet values are prescribed, so their rows do not limit the step size
+        interior = ~self.dirichlet
+        rho = np.max(row_sums[interior]/self.m[interior], initial=0)
+        if self.method == "ssprk3":
+            radius = np.sqrt(3)
+        else:
+            radius = 2
+            symmetric = np.abs(s_elem - s_elem.transpose(0, 2, 1)).max() <= 10**-12*np.abs(s_elem).max()
+            if not symmetric:
+                diagonal = np.bincount(grid.elmat.ravel(), weights=np.diagonal(s_elem, axis1=1, axis2=2).ravel(),
+                                       minlength=n)
+                off_diagonal = row_sums - np.abs(diagonal)
+                if np.any(off_diagonal[interior] > (1 + 10**-8)*diagonal[interior]):
+                    raise ValueError(f"The operators are not symmetric nor diagonally dominant, so their eigenvalues "
+                                     f"can be complex, and no step size is stable for method {self.method}. "
+                                     f"Use method ssprk3, or refine the grid.")
+        return self.cfl*radius/rho if rho > 0 else np.inf
+
+    def get_euler_step(self, c, dt, h):
+        """Return c + dt*dc/dt, with dc/dt = (h - S*c)/m."""
+        s_c = sum(operator.apply(c) for operator in self.operators)
+        return c + dt*(h - s_c)/self.m
+
+    def set_dirichlet_values(self, c, t):
+        g = self.get_dirichlet_values(self.get_bc_functions(t))
+        c[self.dirichlet] = g[self.dirichlet]
+        return c
+
+    def step(self, dt):
+        """Advance the solution by one step of size dt, and return the new coefficients."""
+        c0 = self.c
+        t1 = self.t + dt
+        h1 = self.get_right_hand_side(t1)
+        c = self.set_dirichlet_values(self.get_euler_step(c0, dt, self.h), t1)
+        if self.method == "ssprk2":
+            c = self.set_dirichlet_values(0.5*c0 + 0.5*self.get_euler_step(c, dt, h1), t1)
+        elif self.method == "ssprk3":
+            t_half = self.t + dt/2
+            c = self.set_dirichlet_values(0.75*c0 + 0.25*self.get_euler_step(c, dt, h1), t_half)
+            h_half = self.get_right_hand_side(t_half)
+            c = self.set_dirichlet_values(c0/3 + 2/3*self.get_euler_step(c, dt, h_half), t1)
+        self.accept_step(t1, h1, c)
+        return c
+
+    def iterate(self, t_end, dt=None):
+        """Take steps of size dt until time t_end, yielding after each step.
+
+        Without dt, the stable step size is used. The last step is shortened to end at t_end.
+        """
+        if dt is None:
+            dt = self.dt_stable
+        yield from super().iterate(t_end, dt)
+
+
+class Checkpoint:
+    """Save the state of a transient solution to a compressed .npz file, at most once per interval
+    of wall-clock time in seconds.
+
+    The state contains the grid, the time, the number of steps, the coefficients, the right-hand
+    side, and with matrices=True the assembled matrices, so resuming needs no assembly. The file
+    is first written under a temporary name, and then replaces the previous checkpoint, so an
+    interruption while writing leaves the previous checkpoint intact.
+    """
+    def __init__(self, path, interval=600, matrices=True):
+        self.path = path
+        self.interval = interval
+        self.matrices = matrices
+        self.last_write = time.perf_counter()
+        self.n_writes = 0
+
+    def update(self, transient):
+        """Save the state if the interval has passed since the last checkpoint."""
+        if time.perf_counter() - self.last_write >= self.interval:
+            self.write(transient)
+
+    def write(self, transient):
+        path_tmp = f"{self.path}.tmp"
+        with open(path_tmp, "wb") as file:
+            np.savez_compressed(file, **transient.get_state(self.matrices))
+        os.replace(path_tmp, self.path)
+        self.last_write = time.perf_counter()
+        self.n_writes += 1
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+
+def run(code):
+    # run in a new interpreter, since the modules are already imported in this one
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_import_time():
+    # Test that importing the package is fast, and does not import numpy, scipy or sympy
+
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import flexible_fem\n"
+        "print(time.perf_counter() - start)\n"
+        "print(*[name in sys.modules for name in ['numpy', 'scipy', 'sympy']])\n"
+    )
+    elapsed, *imported = run(code)
+    print(f"import flexible_fem: {float(elapsed)*1000:.1f} ms")
+
+    assert float(elapsed) < 0.1
+    assert imported == ["False", "False", "False"]
+
+
+def test_lazy_submodules():
+    # Test that submodules are imported on first use, and sympy only when an exact solution is computed
+
+    code = (
+        "import sys\n"
+        "import flexible_fem as fem\n"
+        "fem.front.NumericalSolution\n"
+        "print('flexible_fem.core' in sys.modules, 'scipy.integrate' in sys.modules, 'sympy' in sys.modules)\n"
+        "fem.exact.ExactSolution\n"
+        "print('sympy' in sys.modules)\n"
+    )
+    assert run(code) == ["True", "False", "False", "False"]
@@ -166,6 +166,44 @@ def test_sdr_1D_B():
     assert np.square(u_fem-u_exact).mean() < 10**-12
 
 
+def test_sadr_1D_sweep():
+    pde = "steady_advection_diffusion_reaction_1D"
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann"
+    }
+    bc_params = {
+        "left": ["constant", 1],
+        "right": ["constant", 0.5]
+        }
+    grid_params = {
+        "L": 1.7,
+        "n": 50
+    }
+    core_params = {
+        "A":        np.array([0.5, 1.0, 2.0]),
+        "D":        np.array([0.1, 0.05, 0.02]),
+        "R":        1.3
+    }
+    source_params = {
+        "function": "periodic",
+        "alpha":    0.8,
+        "beta":     3.5,
+        "gamma":    3
+        }
+
+    u_sweep, x_sweep = fem.front.NumericalSolution().get_solution_sweep(pde, bc_types, bc_params, grid_params,
+                                                                        core_params, source_params)
+    assert u_sweep.shape == (3, grid_params["n"])
+
+    for i in range(3):
+        params = {"A": core_params["A"][i], "D": core_params["D"][i], "R": core_params["R"]}
+        u_fem, x_fem = fem.front.NumericalSolution().get_solution(pde, bc_types, bc_params, grid_params,
+                                                                  params, source_params)
+        assert np.abs(u_sweep[i]-u_fem).max() < 10**-10
+        assert np.abs(x_sweep-x_fem).max() < 10**-12
+
+
 # For debugging purposes
 if __name__ == '__main__':
     test_sdr_1D_A()
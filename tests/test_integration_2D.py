@@ -73,6 +73,85 @@ def test_laplace_2D_B():
     assert np.square(u_fem-u_exact).mean() < 10**-4
 
 
+def test_laplace_2D_sweep():
+    pde = "laplace_2D"
+    bc_types = {
+        "left": "neumann",
+        "right": "dirichlet",
+        "bottom": "dirichlet",
+        "top": "dirichlet",
+    }
+    grid_params = {
+        "L": 0.25,
+        "H": 0.35,
+        "nx": 5,
+        "ny": 6
+    }
+    bc_params = {
+        "left": ["sine", 0, 1, np.pi/(grid_params["H"]), 0, 0],  # g(y) = a + b*sin(c*y)
+        "right": ["sine", 0, 1, np.pi/(grid_params["H"]), 0, 0],  # g(y) = a + b*sin(c*y)
+        "bottom": ["sine", 0, 0, 0, 0, 0],  # g(x) = a + b*sin(c*x)
+        "top": ["sine", 0, 0, 0, 0, 0],  # g(x) = a + b*sin(c*x)
+    }
+    core_params = {
+        "D":        np.array([0.7, 1.3])
+    }
+    source_params = {
+        "function": "zero",
+    }
+
+    u_sweep, x_sweep, y_sweep = fem.front.NumericalSolution().get_solution_sweep(pde, bc_types, bc_params,
+                                                        grid_params, core_params, source_params)
+
+    for i, D in enumerate(core_params["D"]):
+        u_exact, x_exact, y_exact = fem.exact.ExactSolution().get_solution(pde, bc_types, bc_params,
+                                                            grid_params, {"D": D}, source_params)
+        assert np.square(u_sweep[i]-u_exact).mean() < 10**-4
+        assert np.abs(x_sweep-x_exact).max() < 10**-12
+        assert np.abs(y_sweep-y_exact).max() < 10**-12
+
+
+def test_laplace_2D_cg():
+    # Same problem as test_laplace_2D_A, solved with preconditioned conjugate gradients
+    pde = "laplace_2D"
+    bc_types = {
+        "left": "dirichlet",
+        "right": "dirichlet",
+        "bottom": "dirichlet",
+        "top": "dirichlet",
+    }
+    grid_params = {
+        "L": 1,
+        "H": 1,
+        "nx": 6,
+        "ny": 6
+    }
+    bc_params = {
+        "left": ["sine", 0, 1, np.pi/(grid_params["H"]), 0, 0],  # g(y) = a + b*sin(c*y)
+        "right": ["sine", 0, 1, np.pi/(grid_params["H"]), 0, 0],  # g(y) = a + b*sin(c*y)
+        "bottom": ["sine", 0, 0, 0, 0, 0],  # g(x) = a + b*sin(c*x)
+        "top": ["sine", 0, 0, 0, 0, 0],  # g(x) = a + b*sin(c*x)
+    }
+    core_params = {
+        "D":        1
+    }
+    source_params = {
+        "function": "zero",
+    }
+    solver_params = {
+        "method": "cg",
+        "preconditioner": "jacobi"
+    }
+
+    u_exact, x_exact, y_exact = fem.exact.ExactSolution().get_solution(pde, bc_types, bc_params,
+                                                        grid_params, core_params, source_params)
+    u_fem, x_fem, y_fem = fem.front.NumericalSolution().get_solution(pde, bc_types, bc_params,
+                                                        grid_params, core_params, source_params,
+                                                        solver_params)
+
+    assert np.square(u_fem-u_exact).mean() < 10**-4
+
+
 # For debugging purposes
 if __name__ == '__main__':
     test_laplace_2D_A()
@@ -29,6 +29,28 @@ def test_source_1D():
     assert np.square(source.d-reference_source).max() < 10**-8
 
 
+def test_source_1D_reference():
+    # Test the fixed quadrature rule against adaptive (reference) quadrature for the source operator
+
+    L = 1
+    n = 9
+    alpha = 0.5
+    beta = 2
+    gamma = 30
+
+    # periodic source term:
+    f = lambda xy: alpha + beta*np.sin(gamma*xy[0])
+
+    dim = 1
+
+    grid = fem.core.Grid(dim, L, n)
+
+    source = fem.core.Source(grid, fem.core.Discretization(dim), f)
+    reference_source = fem.core.Source(grid, fem.core.Discretization(dim, quadrature="reference"), f)
+
+    assert np.abs(source.d-reference_source.d).max() < 10**-8
+
+
 def test_diffusion_1D():
     # Test the construction of the diffusion operator
 
@@ -156,6 +178,122 @@ def test_advection_1D():
     assert np.square(stiffness.s-reference_stiffness).max() < 10**-8
 
 
+def test_unit_matrix_cache_1D():
+    # Test that operators of the same type on one grid share one assembled unit-coefficient matrix
+
+    L = 1
+    n = 5
+    bc_types = {
+        "left": "neumann",
+        "right": "neumann"
+    }
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+
+    dim = 1
+
+    grid = fem.core.Grid(dim, L, n)
+
+    discretization = fem.core.Discretization(dim)
+
+    first = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1.3)
+    unit = first.get_unit_matrix()
+    second = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 0.4)
+
+    assert second.get_unit_matrix() is unit
+    assert len(grid.unit_matrices) == 1
+    assert np.abs(first.s-1.3*unit).max() < 10**-12
+    assert np.abs(second.s-0.4*unit).max() < 10**-12
+
+
+def test_fused_operator_1D():
+    # Test that single-pass assembly of several operators gives the sum of the separate operators
+
+    L = 1.7
+    n = 11
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann"
+    }
+    bc_params = {
+        "left": ["constant", 2],
+        "right": ["constant", -1]
+    }
+    bc_functions = {}
+    for lb in bc_params:
+        if bc_params[lb][0] == "constant":
+            bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1]
+
+    dim = 1
+
+    grid = fem.core.Grid(dim, L, n)
+
+    discretization = fem.core.Discretization(dim)
+
+    operators = [fem.core.Advection(grid, discretization, bc_types, bc_functions, 0.9),
+                 fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1.5),
+                 fem.core.Reaction(grid, discretization, bc_types, bc_functions, 0.8)]
+    stiffness = fem.core.SolutionOperator(grid, discretization, operators)
+    natural_boundary = fem.core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+
+    kernels = [fem.core.Advection(grid, discretization, bc_types, bc_functions, 0.9, assemble=False),
+               fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1.5, assemble=False),
+               fem.core.Reaction(grid, discretization, bc_types, bc_functions, 0.8, assemble=False)]
+    # small batches, to test assembly over multiple batches of elements
+    fused = fem.core.FusedOperator(grid, discretization, bc_types, bc_functions, kernels, batch_size=3)
+
+    assert np.abs(fused.s-stiffness.s).max() < 10**-12
+    assert np.abs(fused.b_nat-natural_boundary.b_nat).max() < 10**-12
+
+
+def test_varying_coefficients_1D():
+    # Test coefficients given per element and as function of x against reference quadrature, and the
+    # solution of -(D*u_x)_x = 0 for a discontinuous D
+
+    L = 1
+    n = 9
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann"
+    }
+    bc_functions = {
+        "left": lambda xy: 0,
+        "right": lambda xy: 1
+    }
+
+    dim = 1
+
+    grid = fem.core.Grid(dim, L, n)
+
+    discretization = fem.core.Discretization(dim)
+    reference_discretization = fem.core.Discretization(dim, quadrature="reference")
+
+    D_elem = np.where(grid.xy_elem < 0.5, 1, 4)
+    D_function = lambda xy: 1 + xy[:, 0]**2
+    for operator in [fem.core.Diffusion, fem.core.Reaction, fem.core.Advection]:
+        for coeff in [D_elem, D_function]:
+            batched = operator(grid, discretization, bc_types, bc_functions, coeff)
+            reference = operator(grid, reference_discretization, bc_types, bc_functions, coeff)
+            assert np.abs(batched.s-reference.s).max() < 10**-8
+            assert np.abs(batched.b_nat-reference.b_nat).max() < 10**-8
+
+    kernels = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D_function, assemble=False),
+               fem.core.Reaction(grid, discretization, bc_types, bc_functions, D_elem, assemble=False)]
+    fused = fem.core.FusedOperator(grid, discretization, bc_types, bc_functions, kernels, batch_size=3)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D_function),
+                 fem.core.Reaction(grid, discretization, bc_types, bc_functions, D_elem)]
+    stiffness = fem.core.SolutionOperator(grid, discretization, operators)
+    assert np.abs(fused.s-stiffness.s).max() < 10**-12
+
+    # the neumann condition u_x = 1 at the right gives a constant flux D*u_x = 4, so u_x = 4/D, and
+    # the solution is exact at the vertices
+    diffusion = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D_elem)
+    source = fem.core.Source(grid, discretization, lambda xy: 0)
+    solution = fem.core.Solution(grid, discretization, bc_types, bc_functions, diffusion, source, diffusion,
+                                 grid.xy_vert[:, None])
+    u_exact = np.where(grid.xy_vert < 0.5, 4*grid.xy_vert, 2 + (grid.xy_vert - 0.5))
+    assert np.abs(solution.u-u_exact).max() < 10**-12
+
+
 def test_natural_boundary_1D():
     # Test the construction of the natural boundary vector for a diffusion operator
 
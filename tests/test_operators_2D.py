@@ -1,8 +1,115 @@
+from math import factorial
+
 import numpy as np
+import pytest
+import scipy as sp
 
 import flexible_fem as fem
 
 
+def test_grid_2D():
+    # Test the numbering of vertices, elements and boundary elements of a structured grid
+
+    grid = fem.core.Grid(2, 2, 3, 1, 2)
+
+    reference_vert = np.array([[0, 0], [0, 1], [1, 0], [1, 1], [2, 0], [2, 1]])
+    reference_elmat = np.array([[0, 3, 1], [0, 2, 3], [2, 5, 3], [2, 4, 5]])
+    reference_belmat = np.array([[0, 1], [4, 5], [0, 2], [2, 4], [1, 3], [3, 5]])
+    reference_loc = ["left", "right", "bottom", "bottom", "top", "top"]
+
+    assert np.array_equal(grid.xy_vert, reference_vert)
+    assert np.array_equal(grid.elmat, reference_elmat)
+    assert np.array_equal(grid.belmat, reference_belmat)
+    assert [grid.bound_labels[code] for code in grid.loc_bound] == reference_loc
+    assert np.allclose(grid.xy_elem[0], [1/3, 2/3])
+    assert np.allclose(grid.xy_bound[3], [1.5, 0])
+
+
+def test_boundary_sets_2D():
+    # Test the boundary elements and vertices per label, and the dirichlet values at shared corners
+
+    grid = fem.core.Grid(2, 2, 3, 1, 2)
+
+    assert np.array_equal(grid.boundary_elements["bottom"], [2, 3])
+    assert np.array_equal(grid.boundary_vertices["left"], [0, 1])
+    assert np.array_equal(grid.boundary_vertices["top"], [1, 3, 5])
+
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann",
+        "bottom": "dirichlet",
+        "top": "dirichlet",
+    }
+    bc_functions = {lb: lambda xy, value=value: np.full(len(xy), value) for value, lb in enumerate(bc_types)}
+
+    discretization = fem.core.Discretization(2)
+    source = fem.core.Source(grid, discretization, lambda xy: 0)
+    diffusion = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1)
+    solution = fem.core.Solution(grid, discretization, bc_types, bc_functions, diffusion, source, diffusion,
+                                 grid.xy_vert)
+
+    # bottom and top take precedence over left at the corners, right is a neumann boundary
+    assert np.array_equal(solution.dirichlet, [True, True, True, True, True, True])
+    assert np.array_equal(solution.get_dirichlet_values(), [2, 3, 2, 3, 2, 3])
+
+
+def test_locate_points_2D():
+    # Test the point location index on a structured grid, and the KD-tree fallback
+
+    grid = fem.core.Grid(2, 1.2, 5, 0.7, 4)
+    discretization = fem.core.Discretization(2)
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform([-0.1, -0.1], [1.3, 0.8], (200, 2))
+
+    elem, bary = grid.locate_points(points)
+
+    for p, e, b in zip(points, elem, bary):
+        if e < 0:
+            assert not any(discretization.check_if_point_in_element(grid.xy_vert[ev], p) for ev in grid.elmat)
+        else:
+            vert_coords = grid.xy_vert[grid.elmat[e]]
+            assert discretization.check_if_point_in_element(vert_coords, p)
+            assert np.allclose(b @ vert_coords, p)
+
+    grid.structured = False
+    tree_elem, tree_bary = fem.core.PointLocator(grid).locate(points)
+
+    assert np.array_equal(tree_elem >= 0, elem >= 0)
+    inside = elem >= 0
+    # points on shared edges may be assigned to either element, but with the same location
+    assert np.allclose(np.einsum('pk,pkd->pd', tree_bary[inside], grid.xy_vert[grid.elmat[tree_elem[inside]]]), points[inside])
+
+
+def test_locate_points_unstructured_2D():
+    # Test the KD-tree point location on a grid with perturbed vertices against a brute force search
+
+    grid = fem.core.Grid(2, 1.2, 9, 0.7, 7)
+    discretization = fem.core.Discretization(2)
+
+    # move the interior vertices by up to a quarter of the spacing, which keeps all triangles valid
+    rng = np.random.default_rng(1)
+    boundary = np.unique(np.concatenate(list(grid.boundary_vertices.values())))
+    interior = np.setdiff1d(np.arange(len(grid.xy_vert)), boundary)
+    spacing = np.array([1.2/8, 0.7/6])
+    grid.xy_vert[interior] += rng.uniform(-0.25, 0.25, (len(interior), 2))*spacing
+    grid.xy_elem = grid.xy_vert[grid.elmat].sum(axis=1)/3
+    grid.structured = False
+
+    points = rng.uniform([-0.1, -0.1], [1.3, 0.8], (300, 2))
+    elem, bary = grid.locate_points(points)
+
+    for p, e, b in zip(points, elem, bary):
+        found = [i for i, ev in enumerate(grid.elmat) if discretization.check_if_point_in_element(grid.xy_vert[ev], p)]
+        if len(found) == 0:
+            assert e < 0
+        else:
+            assert e in found
+            vert_coords = grid.xy_vert[grid.elmat[e]]
+            b_reference = np.linalg.solve(np.vstack([vert_coords.T, np.ones(3)]), np.append(p, 1))
+            assert np.allclose(b, b_reference)
+
+
 def test_diffusion_2D():
     # Test the construction of the diffusion operator
 
@@ -59,6 +166,329 @@ def test_diffusion_2D():
     assert np.square(stiffness.s-reference_stiffness).max() < 10**-8
 
 
+def test_diffusion_2D_sparse():
+    # Test that the stiffness matrix is assembled in sparse form, with at most 7 nonzeros per row
+
+    dim = 2
+    D = 1.3
+    L = 1.2
+    nx = 9
+    H = 1.5
+    ny = 11
+
+    bc_types = {
+        "left": "neumann",
+        "right": "neumann",
+        "bottom": "neumann",
+        "top": "neumann",
+    }
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+
+    grid = fem.core.Grid(dim, L, nx, H, ny)
+
+    discretization = fem.core.Discretization(dim)
+
+    diffusion = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D)
+
+    operators = [diffusion]
+    stiffness = fem.core.SolutionOperator(grid, discretization, operators)
+
+    assert sp.sparse.issparse(stiffness.s)
+    assert stiffness.s.shape == (nx*ny, nx*ny)
+    assert np.diff(stiffness.s.indptr).max() <= 7
+    # rows of the diffusion operator sum to zero
+    assert np.abs(stiffness.s.sum(axis=1)).max() < 10**-8
+
+
+def test_sparsity_pattern_2D():
+    # Test assembly through the precomputed sparsity pattern and scatter map against COO assembly
+
+    grid = fem.core.Grid(2, 1.2, 5, 1.5, 4)
+    discretization = fem.core.Discretization(2)
+    bc_types = {lb: "neumann" for lb in ["left", "right", "bottom", "top"]}
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+
+    diffusion = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1.3)
+    reaction = fem.core.Reaction(grid, discretization, bc_types, bc_functions, 0.6)
+
+    indptr, indices, scatter = grid.get_sparsity_pattern()
+    k = grid.elmat.shape[1]
+    assert scatter.shape == (len(grid.elmat)*k*k,)
+    assert grid.get_sparsity_pattern()[2] is scatter
+
+    for operator in [diffusion, reaction]:
+        s_elem = operator.generate_element_matrices()
+        rows = np.repeat(grid.elmat, k, axis=1).ravel()
+        cols = np.tile(grid.elmat, (1, k)).ravel()
+        reference = sp.sparse.coo_matrix((s_elem.ravel(), (rows, cols)), shape=operator.s.shape).tocsr()
+        assert np.abs(operator.s-reference).max() < 10**-12
+        assert np.array_equal(operator.s.indptr, indptr)
+        assert np.array_equal(operator.s.indices, indices)
+
+    # combined operators add their data directly, since they share the pattern
+    stiffness = fem.core.SolutionOperator(grid, discretization, [diffusion, reaction])
+    assert np.abs(stiffness.s-(diffusion.s.toarray()+reaction.s.toarray())).max() < 10**-12
+
+
+def test_quadrature_2D():
+    # Test that the fixed triangle rules integrate monomials xi^p*eta^q exactly up to their degree
+
+    for degree in range(8):
+        rule = fem.core.Quadrature(2, degree)
+        for p in range(degree + 1):
+            for q in range(degree + 1 - p):
+                exact = factorial(p)*factorial(q)/factorial(p + q + 2)
+                result = np.sum(rule.weights*rule.points[:, 0]**p*rule.points[:, 1]**q)
+                assert abs(result - exact) < 10**-12
+
+
+def test_element_matrices_2D_reference():
+    # Test the batched element matrices against element-by-element reference quadrature
+
+    dim = 2
+    L = 1.2
+    nx = 4
+    H = 1.5
+    ny = 5
+
+    bc_types = {
+        "left": "neumann",
+        "right": "neumann",
+        "bottom": "neumann",
+        "top": "neumann",
+    }
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+
+    grid = fem.core.Grid(dim, L, nx, H, ny)
+
+    discretization = fem.core.Discretization(dim)
+    reference_discretization = fem.core.Discretization(dim, quadrature="reference")
+
+    for operator in [fem.core.Diffusion, fem.core.Reaction]:
+        batched = operator(grid, discretization, bc_types, bc_functions, 0.7)
+        reference = operator(grid, reference_discretization, bc_types, bc_functions, 0.7)
+        assert np.abs(batched.generate_element_matrices()-reference.generate_element_matrices()).max() < 10**-8
+        assert np.abs(batched.s-reference.s).max() < 10**-8
+
+
+def test_tabulation_2D():
+    # Test the tabulated shape functions, and the batched source vector against reference quadrature
+
+    grid = fem.core.Grid(2, 1.2, 4, 1.5, 5)
+
+    discretization = fem.core.Discretization(2)
+    tabulation = discretization.get_tabulation(2, 3)
+
+    assert discretization.get_tabulation(2, 3) is tabulation
+    assert np.allclose(tabulation.phi.sum(axis=1), 1)
+    assert np.allclose(tabulation.phi, discretization.evaluate_shape_functions(discretization.basis_functions,
+                                                                              tabulation.points))
+    assert discretization.get_tabulation(1, 3).phi.shape[1] == 2
+
+    vert_coords = grid.get_element_coordinates()
+    xy = discretization.map_points(vert_coords, tabulation)
+    for e in [0, 7, 23]:
+        for q, xieta in enumerate(tabulation.points):
+            xy_e = discretization.coordinate_transformation(vert_coords[e], lambda xy: xy)(xieta)
+            assert np.allclose(xy[e, q], np.ravel(xy_e))
+
+    f = lambda xy: np.sin(3*xy[0])*xy[1]
+    source = fem.core.Source(grid, discretization, f)
+    reference_source = fem.core.Source(grid, fem.core.Discretization(2, quadrature="reference"), f)
+
+    assert np.abs(source.d-reference_source.d).max() < 10**-8
+
+    # in batches of elements
+    batched = fem.core.Source(grid, discretization, f, batch_size=7)
+    assert np.abs(batched.d-source.d).max() < 10**-15
+
+
+def test_element_cache_2D():
+    # Test that element matrices taken from the geometry cache equal the computed element matrices
+
+    bc_types = {
+        "left": "neumann",
+        "right": "neumann",
+        "bottom": "neumann",
+        "top": "neumann",
+    }
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+
+    grid = fem.core.Grid(2, 1.2, 6, 1.5, 5)
+    n_elem = len(grid.elmat)
+
+    cache = fem.core.ElementMatrixCache()
+    discretization = fem.core.Discretization(2)
+    cached_discretization = fem.core.Discretization(2, element_cache=cache)
+
+    for operator in [fem.core.Diffusion, fem.core.Reaction, fem.core.Advection]:
+        computed = operator(grid, discretization, bc_types, bc_functions, 0.7, assemble=False)
+        cached = operator(grid, cached_discretization, bc_types, bc_functions, 0.7, assemble=False)
+        assert np.abs(computed.generate_element_matrices()-cached.generate_element_matrices()).max() < 10**-12
+
+    # a structured grid has two element shapes
+    assert cache.misses == 3*2
+    assert cache.hits == 3*(n_elem - 2)
+    assert len(cache.entries) == 6
+
+    cached.generate_element_matrices()
+    assert cache.misses == 3*2
+    assert cache.hits == 4*n_elem - 3*2
+
+    # least recently used entries are removed first
+    small_cache = fem.core.ElementMatrixCache(maxsize=1)
+    cached = fem.core.Diffusion(grid, fem.core.Discretization(2, element_cache=small_cache), bc_types, bc_functions,
+                                0.7, assemble=False)
+    cached.generate_element_matrices()
+    cached.generate_element_matrices()
+    assert len(small_cache.entries) == 1
+    assert small_cache.misses == 4
+
+
+def test_vectorized_functions_2D():
+    # Test that functions of arrays of points, and functions of a single point give the same operators
+
+    grid = fem.core.Grid(2, 1.2, 6, 1.5, 5)
+    discretization = fem.core.Discretization(2)
+
+    f_point = lambda xy: np.sin(3*xy[0])*xy[1]
+    f_array = lambda xy: np.sin(3*xy[:, 0])*xy[:, 1]
+
+    points = np.array([[0.1, 0.2], [0.3, 0.4]])
+    assert np.allclose(discretization.evaluate_function(f_point, points), [np.sin(0.3)*0.2, np.sin(0.9)*0.4])
+    assert np.allclose(discretization.evaluate_function(f_array, points), [np.sin(0.3)*0.2, np.sin(0.9)*0.4])
+    assert np.allclose(discretization.evaluate_function(lambda xy: 2, points), [2, 2])
+    # one value per point as column is flattened, other shapes are rejected
+    assert np.allclose(discretization.evaluate_function(lambda xy: xy[:, [0]], points), [0.1, 0.3])
+    with pytest.raises(ValueError):
+        discretization.evaluate_function(lambda xy: xy[:, [0, 1]], points)
+    # a single value is not taken as constant if the function reduces over its argument
+    norm = lambda xy: np.linalg.norm(xy)
+    assert np.allclose(discretization.evaluate_function(norm, points), np.linalg.norm(points, axis=1))
+    source_norm = fem.core.Source(grid, discretization, norm)
+    source_reference = fem.core.Source(grid, fem.core.Discretization(2, quadrature="reference"), norm)
+    assert np.abs(source_norm.d-source_reference.d).max() < 10**-6
+
+    source_point = fem.core.Source(grid, discretization, f_point)
+    source_array = fem.core.Source(grid, discretization, f_array)
+    assert np.abs(source_point.d-source_array.d).max() < 10**-12
+
+    bc_types = {
+        "left": "neumann",
+        "right": "dirichlet",
+        "bottom": "neumann",
+        "top": "neumann",
+    }
+    bc_point = {lb: f_point for lb in bc_types}
+    bc_array = {lb: f_array for lb in bc_types}
+    diffusion_point = fem.core.Diffusion(grid, discretization, bc_types, bc_point, 0.7)
+    diffusion_array = fem.core.Diffusion(grid, discretization, bc_types, bc_array, 0.7)
+    reference = fem.core.Diffusion(grid, fem.core.Discretization(2, quadrature="reference"), bc_types, bc_array, 0.7)
+    assert np.abs(diffusion_point.b_nat-diffusion_array.b_nat).max() < 10**-12
+    assert np.abs(reference.b_nat-diffusion_array.b_nat).max() < 10**-8
+
+
+def test_solution_field_2D():
+    # Test values and gradients of the solution field for a linear solution, which is represented exactly
+
+    grid = fem.core.Grid(2, 1.2, 6, 0.7, 5)
+    discretization = fem.core.Discretization(2)
+
+    bc_types = {
+        "left": "dirichlet",
+        "right": "dirichlet",
+        "bottom": "dirichlet",
+        "top": "dirichlet",
+    }
+    u_exact = lambda xy: 1 + 2*xy[:, 0] + 3*xy[:, 1]
+    bc_functions = {lb: u_exact for lb in bc_types}
+
+    source = fem.core.Source(grid, discretization, lambda xy: 0)
+    diffusion = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1)
+    solution = fem.core.Solution(grid, discretization, bc_types, bc_functions, diffusion, source, diffusion)
+    field = solution.field
+
+    rng = np.random.default_rng(1)
+    points = rng.uniform([0, 0], [1.2, 0.7], (1000, 2))
+    assert np.abs(field(points)-u_exact(points)).max() < 10**-12
+    assert np.abs(field.gradient(points)-[2, 3]).max() < 10**-10
+    assert np.all(field([[1.3, 0.1], [-0.1, 0.1]]) == 0)
+
+    assert solution.u is field.get_nodal_values()
+    U, X, Y = field.sample_grid()
+    assert U.shape == (5, 6)
+    assert np.shares_memory(U, solution.c)
+    assert np.abs(U-(1 + 2*X + 3*Y)).max() < 10**-12
+
+
+def test_matrix_free_2D():
+    # Test the matrix-free products of the operators, and the lumped mass matrix
+
+    grid = fem.core.Grid(2, 1.2, 6, 0.7, 5)
+    discretization = fem.core.Discretization(2)
+
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann",
+        "bottom": "neumann",
+        "top": "neumann",
+    }
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+
+    coeff_elem = 1 + grid.xy_elem[:, 0]
+    coeff_function = lambda xy: 1 + xy[:, 0]*xy[:, 1]
+    rng = np.random.default_rng(2)
+    u = rng.uniform(-1, 1, len(grid.xy_vert))
+    for operator in [fem.core.Diffusion, fem.core.Reaction, fem.core.Advection]:
+        for coeff in [0.7, coeff_elem, coeff_function]:
+            assembled = operator(grid, discretization, bc_types, bc_functions, coeff)
+            kernel = operator(grid, discretization, bc_types, bc_functions, coeff, assemble=False)
+            assert np.abs(kernel.apply(u)-assembled.s @ u).max() < 10**-12
+            assert np.abs(kernel.get_row_sums()-assembled.s.sum(axis=1).A1).max() < 10**-12
+        # the kept element data follows a change of the coefficient
+        kernel.coeff = 2*coeff_elem
+        assembled = operator(grid, discretization, bc_types, bc_functions, 2*coeff_elem)
+        assert np.abs(kernel.apply(u)-assembled.s @ u).max() < 10**-12
+
+    # the lumped mass matrix is diagonal, with the row sums of the consistent mass matrix, which
+    # sum to the area of the domain
+    mass = fem.core.Reaction(grid, discretization, bc_types, bc_functions, 1)
+    lumped = fem.core.Reaction(grid, discretization, bc_types, bc_functions, 1, lumped=True)
+    assert np.abs(lumped.s-sp.sparse.diags(mass.s.sum(axis=1).A1)).max() < 10**-12
+    assert abs(lumped.s.sum()-1.2*0.7) < 10**-12
+    reference = fem.core.Reaction(grid, fem.core.Discretization(2, quadrature="reference"), bc_types,
+                                  bc_functions, 1, lumped=True)
+    assert np.abs(lumped.s-reference.s).max() < 10**-8
+
+
+def test_chunked_evaluator_2D(tmp_path):
+    # Test chunked evaluation of a solution field from a memmap and from an iterator
+
+    grid = fem.core.Grid(2, 1, 5, 1, 4)
+    rng = np.random.default_rng(2)
+    field = fem.core.SolutionField(grid, fem.core.Discretization(2), rng.uniform(size=len(grid.xy_vert)))
+
+    points = np.lib.format.open_memmap(tmp_path / "points.npy", mode="w+", dtype=float, shape=(1005, 2))
+    points[:] = rng.uniform(0, 1, (1005, 2))
+    out = np.lib.format.open_memmap(tmp_path / "values.npy", mode="w+", dtype=float, shape=(1005,))
+
+    evaluator = fem.core.ChunkedEvaluator(field, chunk_size=100)
+    evaluator.evaluate_to(points, out)
+    assert np.abs(np.load(tmp_path / "values.npy")-field(points)).max() < 10**-14
+    assert evaluator.info["points"] == 1005
+    assert evaluator.info["points_per_second"] > 0
+
+    # iterator over single points, and over arrays of points of varying size
+    chunks = list(evaluator.evaluate(iter(points[:250])))
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert np.abs(np.concatenate(chunks)-field(points[:250])).max() < 10**-14
+    chunks = list(evaluator.evaluate(iter([points[:30], points[30:170], points[170:250]])))
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+
+    gradients = fem.core.ChunkedEvaluator(field, chunk_size=100, gradient=True).evaluate_to(points)
+    assert np.abs(gradients-field.gradient(points)).max() < 10**-14
+
+
 # For debugging purposes
 if __name__ == '__main__':
     test_diffusion_2D()
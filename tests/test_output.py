@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import flexible_fem as fem
+
+
+def get_heat_equation_2D():
+    # u_t = u_xx + u_yy on [0, 1]x[0, 1], with u = 0 on the boundary
+    bc_types = {
+        "left": "dirichlet",
+        "right": "dirichlet",
+        "bottom": "dirichlet",
+        "top": "dirichlet",
+    }
+    bc_functions = {lb: lambda xy, t: 0 for lb in bc_types}
+    f = lambda xy, t: 0
+    u0 = lambda xy: np.sin(np.pi*xy[:, 0])*np.sin(np.pi*xy[:, 1])
+
+    grid = fem.core.Grid(2, 1, 9, 1, 7)
+    discretization = fem.core.Discretization(2)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1, assemble=False)]
+    transient = fem.transient.TransientSolution(grid, discretization, bc_types, bc_functions, operators, f, u0)
+    return transient
+
+
+def test_snapshots():
+    # Test the decimation of the snapshots of a transient solution
+
+    transient = get_heat_equation_2D()
+    snapshots = list(transient.snapshots(0.1, 0.01, every=3))
+    # the start, steps 3, 6 and 9, and the end
+    assert [step for step, t, c in snapshots] == [0, 3, 6, 9, 10]
+    assert np.allclose([t for step, t, c in snapshots], [0, 0.03, 0.06, 0.09, 0.1])
+    assert snapshots[-1][2] is transient.c
+
+    # the solution decays, so the changes between steps become smaller
+    transient = get_heat_equation_2D()
+    snapshots = list(transient.snapshots(0.5, 0.01, threshold=0.1))
+    c = np.array([c for step, t, c in snapshots])
+    assert len(snapshots) < 10
+    assert np.all(np.abs(np.diff(c[:-1], axis=0)).max(axis=1) > 0.1)
+    steps = [step for step, t, c in snapshots]
+    assert np.all(np.diff(steps, 2) >= 0)
+
+
+def test_time_series(tmp_path):
+    # Test writing the snapshots of a transient solution, and reading them lazily
+
+    transient = get_heat_equation_2D()
+    path = tmp_path/"run"
+    with fem.output.TimeSeriesWriter(path, transient.grid, 20) as writer:
+        transient.solve(0.1, 0.01, callback=writer, every=2)
+    assert writer.count == 6
+
+    reader = fem.output.TimeSeriesReader(path)
+    assert len(reader) == 6
+    assert np.allclose(reader.times, [0, 0.02, 0.04, 0.06, 0.08, 0.1])
+    assert np.array_equal(reader.steps, [0, 2, 4, 6, 8, 10])
+    assert isinstance(reader.values, np.memmap)
+    assert np.array_equal(reader[-1], transient.c)
+
+    times, values = reader.get_time_range(0.03, 0.08)
+    assert np.allclose(times, [0.04, 0.06, 0.08])
+    assert isinstance(values, np.memmap)
+    assert values.shape == (3, 63)
+
+    field = reader.get_field(-1)
+    assert field.grid.shape == (9, 7)
+    assert np.allclose(field.grid.xy_vert, transient.grid.xy_vert)
+    points = np.array([[0.3, 0.4], [0.5, 0.5]])
+    assert np.allclose(field(points), transient.field(points))
+
+    # a full time series raises an error
+    writer = fem.output.TimeSeriesWriter(tmp_path/"short", transient.grid, 2)
+    writer(0, 0, transient.c)
+    writer(1, 0.01, transient.c)
+    with pytest.raises(ValueError):
+        writer(2, 0.02, transient.c)
+    assert len(fem.output.TimeSeriesReader(tmp_path/"short")) == 2
@@ -0,0 +1,219 @@
+import numpy as np
+import pytest
+import scipy.sparse.linalg
+
+import flexible_fem as fem
+
+
+def get_operators_1D(n, A, D, R):
+    # Advection-diffusion-reaction operators with dirichlet boundary conditions
+    L = 1
+    bc_types = {
+        "left": "dirichlet",
+        "right": "dirichlet"
+    }
+    bc_params = {
+        "left": ["constant", 0],
+        "right": ["constant", 1]
+    }
+    bc_functions = {}
+    for lb in bc_params:
+        if bc_params[lb][0] == "constant":
+            bc_functions[lb] = lambda xy, lb=lb: bc_params[lb][1]
+
+    f = lambda xy: 0.5 + 2*np.sin(30*xy[0])
+
+    dim = 1
+
+    grid = fem.core.Grid(dim, L, n)
+
+    discretization = fem.core.Discretization(dim)
+
+    source = fem.core.Source(grid, discretization, f)
+
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D),
+                 fem.core.Reaction(grid, discretization, bc_types, bc_functions, R)]
+    if A != 0:
+        operators.append(fem.core.Advection(grid, discretization, bc_types, bc_functions, A))
+    stiffness = fem.core.SolutionOperator(grid, discretization, operators)
+
+    natural_boundary = fem.core.NaturalBoundary(grid, discretization, bc_types, bc_functions, operators)
+
+    return grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary
+
+
+def test_iterative_solvers_1D():
+    # Test that the iterative solvers reproduce the direct solution
+
+    for A, methods in [(0, ["cg", "gmres", "bicgstab"]), (5, ["gmres", "bicgstab"])]:
+        grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary = get_operators_1D(60, A, 0.1, 0.8)
+        xy = grid.xy_vert
+
+        solver = fem.solvers.LinearSolver(method="direct")
+        reference = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source,
+                                      natural_boundary, xy, solver)
+        assert reference.solver_info["method"] == "direct"
+
+        for method in methods:
+            for preconditioner in [None, "jacobi", "ilu"]:
+                solver = fem.solvers.LinearSolver(method=method, preconditioner=preconditioner)
+                solution = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source,
+                                             natural_boundary, xy, solver)
+                assert solution.solver_info["converged"]
+                if preconditioner != "ilu":
+                    # ilu is exact for tridiagonal systems, so may converge before the first iteration
+                    assert solution.solver_info["iterations"] > 0
+                assert solution.solver_info["residual"] < 10**-8
+                assert np.abs(solution.u-reference.u).max() < 10**-6
+
+
+def test_automatic_solver_selection():
+    # Test that 1D systems are solved banded, and that large other systems use cg if they are
+    # symmetric and gmres otherwise
+
+    for A in [0, 5]:
+        grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary = get_operators_1D(40, A, 0.1, 0.8)
+        xy = grid.xy_vert
+
+        solver = fem.solvers.LinearSolver(direct_limit=10)
+        solution = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source,
+                                     natural_boundary, xy, solver)
+        assert solution.solver_info["method"] == "banded"
+        reference = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source,
+                                      natural_boundary, xy, fem.solvers.LinearSolver(method="direct"))
+        assert np.abs(solution.u-reference.u).max() < 10**-12
+
+    grid = fem.core.Grid(2, 1, 6, 1, 5)
+    discretization = fem.core.Discretization(2)
+    bc_types = {lb: "neumann" for lb in ["left", "right", "bottom", "top"]}
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+    diffusion = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1)
+    advection = fem.core.Advection(grid, discretization, bc_types, bc_functions, 1)
+
+    solver = fem.solvers.LinearSolver(direct_limit=10)
+    assert solver.select_method(diffusion.s) == "cg"
+    assert solver.select_method(diffusion.s + advection.s) == "gmres"
+    assert fem.solvers.LinearSolver().select_method(diffusion.s) == "direct"
+    # the banded solver does not accept 2D systems
+    with pytest.raises(ValueError):
+        fem.solvers.LinearSolver(method="banded").solve(diffusion.s, np.ones(diffusion.s.shape[0]))
+
+
+def test_automatic_solver_2D():
+    # Test the automatic solver on a moderately large 2D diffusion problem, which is factorized
+    # directly with a symmetric ordering, and above the direct_limit solved with cg
+
+    grid = fem.core.Grid(2, 1, 150, 1, 150)
+    discretization = fem.core.Discretization(2)
+    bc_types = {lb: "dirichlet" for lb in ["left", "right", "bottom", "top"]}
+    bc_functions = {lb: lambda xy: xy[0] for lb in bc_types}
+    diffusion = fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1)
+    source = fem.core.Source(grid, discretization, lambda xy: np.sin(3*xy[0])*xy[1])
+    natural_boundary = fem.core.NaturalBoundary(grid, discretization, bc_types, bc_functions, [diffusion])
+    xy = grid.xy_vert
+
+    solutions = {}
+    for direct_limit in [10**6, 10**4]:
+        solver = fem.solvers.LinearSolver(direct_limit=direct_limit)
+        solutions[direct_limit] = fem.core.Solution(grid, discretization, bc_types, bc_functions, diffusion,
+                                                    source, natural_boundary, xy, solver)
+    direct = solutions[10**6].solver_info
+    iterative = solutions[10**4].solver_info
+    assert direct["method"] == "direct" and direct["residual"] < 10**-12
+    assert iterative["method"] == "cg" and iterative["preconditioner"] == "jacobi"
+    assert iterative["converged"] and iterative["residual"] < 10**-9
+    assert np.abs(solutions[10**6].u-solutions[10**4].u).max() < 10**-8
+
+    # the symmetric ordering keeps the factors sparser than the column ordering of nonsymmetric systems
+    linear_system = solutions[10**6].linear_system
+    colamd = scipy.sparse.linalg.splu(linear_system.s_ii.tocsc(), permc_spec="COLAMD")
+    assert linear_system.factorization.nnz < colamd.nnz
+
+
+def test_operator_reuse():
+    # Test that the dirichlet elimination leaves the stiffness matrix unchanged, so it can be reused
+
+    grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary = get_operators_1D(30, 0, 0.1, 0.8)
+    xy = grid.xy_vert
+    s = stiffness.s.copy()
+
+    first = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+    assert abs(stiffness.s-s).max() == 0
+
+    # second solve with different boundary values
+    bc_functions = {"left": lambda xy: 2, "right": lambda xy: 3}
+    second = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+    assert abs(stiffness.s-s).max() == 0
+    assert abs(first.u[0]) < 10**-12 and abs(first.u[-1]-1) < 10**-12
+    assert abs(second.u[0]-2) < 10**-12 and abs(second.u[-1]-3) < 10**-12
+
+    # the reduced system of a symmetric operator is symmetric, so cg can be used
+    solver = fem.solvers.LinearSolver(method="cg")
+    third = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy,
+                              solver)
+    assert np.abs(third.u-second.u).max() < 10**-8
+
+
+def test_factorization_cache():
+    # Test that repeated solves with the same operator reuse one factorization
+
+    grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary = get_operators_1D(50, 2, 0.1, 0.8)
+    xy = grid.xy_vert
+
+    first = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+    # new source and boundary values, same operator
+    source = fem.core.Source(grid, discretization, lambda xy: 1 + xy[0])
+    bc_functions = {"left": lambda xy: 2, "right": lambda xy: 3}
+    second = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+
+    system = second.linear_system
+    assert system is first.linear_system
+    assert system.n_factorizations == 1
+    assert system.n_solves == 2
+
+    # multiple right-hand sides at once
+    b = np.stack([source.d, 2*source.d, np.zeros(len(xy))], axis=1)
+    g = np.stack([second.c, first.c, np.zeros(len(xy))], axis=1)
+    c = system.solve_many(b, g)
+    assert system.n_factorizations == 1
+    for j in range(b.shape[1]):
+        assert np.abs(c[:, j]-system.solve(b[:, j], g[:, j])).max() < 10**-12
+    assert np.abs(c[:, 0]-second.c).max() < 10**-12
+
+    # a different set of dirichlet vertices gives a new linear system
+    bc_types = {"left": "dirichlet", "right": "neumann"}
+    third = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+    assert third.linear_system is not system
+
+    # a reassembled matrix gets a new linear system, even with the same coefficients
+    bc_types = {"left": "dirichlet", "right": "dirichlet"}
+    stiffness.s = 3*stiffness.s
+    fourth = fem.core.Solution(grid, discretization, bc_types, bc_functions, stiffness, source, natural_boundary, xy)
+    assert fourth.linear_system is not system
+    assert np.abs(fourth.linear_system.solve(b[:, 0], np.zeros(len(xy)))
+                  - system.solve(b[:, 0], np.zeros(len(xy)))/3).max() < 10**-12
+
+    # iterative solves reuse the preconditioner
+    grid = fem.core.Grid(2, 1, 12, 1, 10)
+    discretization = fem.core.Discretization(2)
+    bc_types = {"left": "dirichlet", "right": "dirichlet", "bottom": "neumann", "top": "neumann"}
+    bc_functions = {lb: lambda xy: 0 for lb in bc_types}
+    s = (fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1).s
+         + fem.core.Advection(grid, discretization, bc_types, bc_functions, 5).s)
+    dirichlet = (grid.xy_vert[:, 0] == 0) | (grid.xy_vert[:, 0] == 1)
+    b = np.stack([np.ones(len(grid.xy_vert)), grid.xy_vert[:, 1]], axis=1)
+    g = np.zeros(b.shape)
+    reference = fem.solvers.LinearSystem(s, dirichlet, fem.solvers.LinearSolver(method="direct")).solve_many(b, g)
+    system = fem.solvers.LinearSystem(s, dirichlet, fem.solvers.LinearSolver(direct_limit=10))
+    assert system.method == "gmres" and system.preconditioner == "ilu"
+    for i in range(2):
+        c = system.solve_many(b, g)
+        assert system.info["converged"]
+        assert np.abs(c-reference).max() < 10**-8
+    assert system.n_factorizations == 1
+    assert system.n_solves == 4
+
+
+# For debugging purposes
+if __name__ == '__main__':
+    test_iterative_solvers_1D()
@@ -0,0 +1,287 @@
+import numpy as np
+import pytest
+
+import flexible_fem as fem
+
+
+def get_heat_equation_1D(n, theta):
+    # u_t = D*u_xx on [0, 1], with u = 0 at both ends and u(x, 0) = sin(pi*x)
+    D = 0.5
+    bc_types = {
+        "left": "dirichlet",
+        "right": "dirichlet"
+    }
+    bc_functions = {lb: lambda xy, t: 0 for lb in bc_types}
+    f = lambda xy, t: 0
+    u0 = lambda xy: np.sin(np.pi*xy[:, 0])
+
+    grid = fem.core.Grid(1, 1, n)
+    discretization = fem.core.Discretization(1)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False)]
+    transient = fem.transient.TransientSolution(grid, discretization, bc_types, bc_functions, operators, f, u0,
+                                                theta=theta)
+    u_exact = lambda t: np.exp(-D*np.pi**2*t)*np.sin(np.pi*grid.xy_vert)
+    return transient, u_exact
+
+
+def test_theta_method_1D():
+    # Test backward Euler and Crank-Nicolson on the heat equation, and the reuse of the factorization
+
+    errors = {}
+    for theta in [1, 0.5]:
+        errors[theta] = []
+        for dt in [0.02, 0.01]:
+            transient, u_exact = get_heat_equation_1D(201, theta)
+            transient.solve(0.3, dt)
+            assert abs(transient.t - 0.3) < 10**-12
+            assert transient.n_steps == round(0.3/dt)
+            assert len(transient.linear_systems) == 1
+            assert transient.linear_systems[(theta, dt)].n_factorizations == 1
+            errors[theta].append(np.abs(transient.u-u_exact(0.3)).max())
+
+    # first order for backward Euler, second order for Crank-Nicolson
+    assert 1.8 < errors[1][0]/errors[1][1] < 2.2
+    assert errors[0.5][1] < errors[1][1]/10
+
+
+def test_factorization_2D():
+    # Test that all steps of a 2D problem reuse one factorization, or one preconditioner
+
+    bc_types = {lb: "dirichlet" for lb in ["left", "right", "bottom", "top"]}
+    bc_functions = {lb: lambda xy, t: 0 for lb in bc_types}
+    f = lambda xy, t: 1 + 0*xy[:, 0]
+    u0 = lambda xy: np.sin(np.pi*xy[:, 0])*np.sin(np.pi*xy[:, 1])
+
+    grid = fem.core.Grid(2, 1, 30, 1, 30)
+    discretization = fem.core.Discretization(2)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 0.1, assemble=False)]
+    solutions = {}
+    for solver in [None, fem.solvers.LinearSolver(direct_limit=100)]:
+        transient = fem.transient.TransientSolution(grid, discretization, bc_types, bc_functions, operators, f, u0,
+                                                    solver=solver)
+        transient.solve(0.1, 0.01)
+        linear_system = transient.linear_systems[(0.5, 0.01)]
+        assert linear_system.n_factorizations == 1
+        assert linear_system.n_solves == 10
+        solutions[linear_system.method] = transient.u
+
+    # by default, the system is factorized directly at any size, with a direct_limit the
+    # preconditioner of cg is reused
+    assert list(solutions) == ["direct", "cg"]
+    assert transient.solver.direct_limit == 100
+    default = fem.transient.TransientSolution(grid, discretization, bc_types, bc_functions, operators, f, u0)
+    assert default.solver.direct_limit == np.inf
+    assert np.abs(solutions["direct"]-solutions["cg"]).max() < 10**-8
+
+
+def test_time_dependent_bc_1D():
+    # Test u = t + x^2, which solves u_t - u_xx = -1, and is represented exactly at the vertices
+
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann"
+    }
+    bc_functions = {
+        "left": lambda xy, t: t,
+        "right": lambda xy, t: 2*xy[:, 0]
+    }
+    f = lambda xy, t: -1 + 0*xy[:, 0]
+    u_exact = lambda xy, t: t + xy[:, 0]**2
+
+    grid = fem.core.Grid(1, 1, 11)
+    discretization = fem.core.Discretization(1)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1, assemble=False)]
+
+    for theta in [1, 0.5, 0.7]:
+        transient = fem.transient.TransientSolution(grid, discretization, bc_types, bc_functions, operators, f,
+                                                    lambda xy: u_exact(xy, 0), theta=theta)
+        transient.solve(1, 0.1)
+        assert np.abs(transient.u-u_exact(grid.xy_vert[:, None], 1)).max() < 10**-10
+
+
+def test_adaptive_time_stepping_1D():
+    # Test heating of a rod from zero to the steady state u = x*(1-x), with a fast initial transient
+
+    bc_types = {
+        "left": "dirichlet",
+        "right": "dirichlet"
+    }
+    bc_functions = {lb: lambda xy, t: 0 for lb in bc_types}
+    f = lambda xy, t: 2 + 0*xy[:, 0]
+    u0 = lambda xy: 0*xy[:, 0]
+
+    grid = fem.core.Grid(1, 1, 101)
+    discretization = fem.core.Discretization(1)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 1, assemble=False)]
+    t_out = [0.01, 0.1, 1, 10]
+
+    def solve(transient, **kwargs):
+        u = []
+        for t in t_out:
+            transient.solve(t, **kwargs)
+            u.append(transient.u.copy())
+        return np.array(u)
+
+    u_ref = solve(fem.transient.AdaptiveTransientSolution(grid, discretization, bc_types, bc_functions, operators,
+                                                          f, u0, dt_max=1, levels=28, rtol=10**-10, atol=10**-12))
+    # enough levels to resolve the initial layers at the dirichlet boundaries within the tolerance
+    adaptive = fem.transient.AdaptiveTransientSolution(grid, discretization, bc_types, bc_functions, operators,
+                                                       f, u0, dt_max=1, levels=20, rtol=10**-4, atol=10**-8)
+    error_adaptive = np.abs(solve(adaptive) - u_ref).max()
+    fixed = fem.transient.TransientSolution(grid, discretization, bc_types, bc_functions, operators, f, u0)
+    error_fixed = np.abs(solve(fixed, dt=2*10**-3) - u_ref).max()
+    assert np.isclose(adaptive.t, 10)
+    assert error_adaptive < 2*error_fixed
+    # an order of magnitude fewer linear solves than fixed steps at the same accuracy
+    assert 10*adaptive.stats["solves"] < fixed.n_steps
+    assert adaptive.stats["solves"] == 3*(adaptive.stats["accepted"] + adaptive.stats["rejected"])
+    # the step sizes are powers of 2, apart from the one or two steps to each output time
+    dt = np.array(list(adaptive.stats["step_sizes"]))
+    assert np.sum(~np.isclose(np.log2(dt), np.round(np.log2(dt)))) <= 2*len(t_out)
+    assert len(adaptive.linear_systems) <= adaptive.max_factorizations
+    # the steps to the output times are not cached with the allowed step sizes
+    dt_cached = np.array([dt for theta, dt in adaptive.linear_systems])/adaptive.gamma
+    assert np.allclose(np.log2(dt_cached), np.round(np.log2(dt_cached)), rtol=0, atol=10**-12)
+    assert adaptive.stats["forced"] == 0
+
+    # less than two steps of the current size to the output time are taken at once
+    accepted = adaptive.stats["accepted"]
+    adaptive.solve(10.3)
+    assert adaptive.stats["accepted"] - accepted == 1 and adaptive.t == 10.3
+
+    # with too few levels, the initial layers are not resolved at the smallest step size, and the
+    # first steps are accepted above the tolerance
+    coarse = fem.transient.AdaptiveTransientSolution(grid, discretization, bc_types, bc_functions, operators,
+                                                     f, u0, dt_max=1, levels=16, rtol=10**-4, atol=10**-8)
+    with pytest.warns(RuntimeWarning):
+        coarse.solve(0.01)
+    assert coarse.stats["forced"] > 0
+
+
+def test_explicit_time_stepping_1D():
+    # Test the explicit methods with lumped mass on the heat equation, and the stable step size
+
+    D = 0.5
+    n = 51
+    bc_types = {
+        "left": "dirichlet",
+        "right": "dirichlet"
+    }
+    bc_functions = {lb: lambda xy, t: 0 for lb in bc_types}
+    f = lambda xy, t: 0
+    u0 = lambda xy: np.sin(np.pi*xy[:, 0])
+
+    grid = fem.core.Grid(1, 1, n)
+    discretization = fem.core.Discretization(1)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False)]
+    u_exact = np.exp(-D*np.pi**2*0.3)*np.sin(np.pi*grid.xy_vert)
+
+    for method in ["euler", "ssprk2", "ssprk3"]:
+        explicit = fem.transient.ExplicitTransientSolution(grid, discretization, bc_types, bc_functions, operators,
+                                                           f, u0, method=method)
+        # with the lumped mass matrix, forward Euler is stable up to dt = h^2/(2*D)
+        if method != "ssprk3":
+            assert abs(explicit.dt_stable-0.9*(1/(n - 1))**2/(2*D)) < 10**-12
+        explicit.solve(0.3)
+        assert abs(explicit.t - 0.3) < 10**-12
+        assert np.abs(explicit.u-u_exact).max() < 10**-3
+        # no global matrix is assembled
+        assert not hasattr(explicit, "stiffness")
+        assert not hasattr(explicit.mass, "s")
+
+    # forward Euler beyond the stable step size
+    explicit = fem.transient.ExplicitTransientSolution(grid, discretization, bc_types, bc_functions, operators, f,
+                                                       u0, method="euler")
+    explicit.solve(0.3, 1.1*explicit.dt_stable/0.9)
+    assert np.abs(explicit.u).max() > 1
+
+
+def test_explicit_advection_1D():
+    # Test the stable step size of explicit methods with advection, whose eigenvalues are complex
+
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann"
+    }
+    bc_functions = {
+        "left": lambda xy, t: 1,
+        "right": lambda xy, t: 0
+    }
+    f = lambda xy, t: 0*xy[:, 0]
+    u0 = lambda xy: 0*xy[:, 0]
+
+    grid = fem.core.Grid(1, 1, 201)
+    discretization = fem.core.Discretization(1)
+    for D, methods in [(10**-2, ["euler", "ssprk2", "ssprk3"]), (10**-4, ["ssprk3"])]:
+        operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, D, assemble=False),
+                     fem.core.Advection(grid, discretization, bc_types, bc_functions, 1, assemble=False)]
+        for method in methods:
+            explicit = fem.transient.ExplicitTransientSolution(grid, discretization, bc_types, bc_functions,
+                                                               operators, f, u0, method=method)
+            explicit.solve(0.6)
+            assert np.abs(explicit.u).max() < 1.5
+
+    # advection dominated, forward Euler and SSP-RK2 are unstable for any step size
+    for method in ["euler", "ssprk2"]:
+        with pytest.raises(ValueError):
+            fem.transient.ExplicitTransientSolution(grid, discretization, bc_types, bc_functions, operators, f, u0,
+                                                    method=method)
+
+
+def test_checkpoint_1D(tmp_path):
+    # Test that a solution resumed from a checkpoint continues exactly as without interruption
+
+    bc_types = {
+        "left": "dirichlet",
+        "right": "neumann"
+    }
+    bc_functions = {
+        "left": lambda xy, t: np.sin(t),
+        "right": lambda xy, t: 0
+    }
+    f = lambda xy, t: 1 + xy[:, 0]*t
+    u0 = lambda xy: np.sin(np.pi*xy[:, 0])
+
+    grid = fem.core.Grid(1, 1, 41)
+    discretization = fem.core.Discretization(1)
+    operators = [fem.core.Diffusion(grid, discretization, bc_types, bc_functions, 0.5, assemble=False),
+                 fem.core.Advection(grid, discretization, bc_types, bc_functions, 0.2, assemble=False)]
+    args = (grid, discretization, bc_types, bc_functions, operators, f, u0)
+    path = tmp_path/"checkpoint.npz"
+
+    runs = [
+        (fem.transient.TransientSolution, {}, (0.01,), True),
+        (fem.transient.TransientSolution, {"theta": 1}, (0.01,), False),
+        (fem.transient.AdaptiveTransientSolution, {"dt_max": 0.1}, (), True),
+        (fem.transient.ExplicitTransientSolution, {}, (), True)
+    ]
+    for solution, kwargs, solve_args, matrices in runs:
+        # the adaptive steps are shortened to end at the requested times, so the same times are
+        # requested in both runs
+        uninterrupted = solution(*args, **kwargs)
+        for t_end in [0.2, 0.3, 0.5]:
+            uninterrupted.solve(t_end, *solve_args)
+
+        checkpoint = fem.transient.Checkpoint(path, interval=0, matrices=matrices)
+        interrupted = solution(*args, checkpoint=checkpoint, **kwargs)
+        interrupted.solve(0.2, *solve_args)
+        assert interrupted.checkpoint.n_writes == interrupted.n_steps
+        interrupted.solve(0.3, *solve_args)
+
+        resumed = solution.resume(path, *args, checkpoint=checkpoint, **kwargs)
+        assert resumed.t == interrupted.t and resumed.n_steps == interrupted.n_steps
+        if solution is fem.transient.TransientSolution:
+            # the matrices are taken from the checkpoint if they were saved
+            assert hasattr(resumed.stiffness, "b_nat") != matrices
+        resumed.solve(0.5, *solve_args)
+        assert resumed.n_steps == uninterrupted.n_steps
+        assert checkpoint.n_writes == resumed.n_steps
+        assert np.array_equal(resumed.c, uninterrupted.c)
+        if solution is fem.transient.AdaptiveTransientSolution:
+            assert resumed.stats["accepted"] == uninterrupted.stats["accepted"]
+
+    other_grid = fem.core.Grid(1, 2, 41)
+    other_operators = [fem.core.Diffusion(other_grid, discretization, bc_types, bc_functions, 0.5, assemble=False)]
+    with pytest.raises(ValueError):
+        fem.transient.TransientSolution.resume(path, other_grid, discretization, bc_types, bc_functions,
+                                               other_operators, f, u0)